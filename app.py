@@ -2,9 +2,22 @@
 import json
 import random
 import os
-from flask import Flask, render_template, jsonify, request, send_from_directory
+import threading
+import time
+import zlib
+from datetime import datetime
+from flask import Flask, render_template, jsonify, request, send_from_directory, stream_with_context
 import google.generativeai as genai
 from dotenv import load_dotenv
+import metrics
+from batch import BatchRun, BatchSlot, RunBusy, run_status
+from filecache import JSONFileCache
+from gencache import GenerationCache
+from generation import MODEL_NAME, GenerationError, generate_record, model_available, stream_record
+from pool import ANY_MIX, ProvocationPool
+from prompts import PromptBuilder, UnknownChoice, mix_key, parse_mix
+from stats import RatingStats
+from store import ProvocationStore
 
 load_dotenv()
 
@@ -15,6 +28,37 @@ SEEDS_FILE = "seeds.json"
 PROMPT_FILE = "prompt.json"
 CONFIG_FILE = "config.json"
 PROVOCATIONS_FILE = "provocations.json"
+PROVOCATIONS_LOG = "provocations.jsonl"
+POOL_DIR = os.getenv("POOL_DIR", "pool")
+LEGACY_POOL_FILE = "pool.json"
+
+# Pre-generated provocations, refilled in the background (see pool.py)
+POOL_ENABLED = os.getenv("POOL_ENABLED", "1").lower() in ("1", "true", "yes")
+POOL_LOW_WATERMARK = int(os.getenv("POOL_LOW_WATERMARK", "2"))
+POOL_HIGH_WATERMARK = int(os.getenv("POOL_HIGH_WATERMARK", "5"))
+POOL_IDLE_EXPIRY = float(os.getenv("POOL_IDLE_EXPIRY", "86400"))  # seconds
+
+# Paging through /api/provocations
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+# Batch generation (see batch.py)
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "1000"))
+BATCH_MAX_WORKERS = int(os.getenv("BATCH_MAX_WORKERS", "8"))
+BATCH_MAX_RATE = float(os.getenv("BATCH_MAX_RATE", "2"))  # model calls per second
+
+# Replies to identical prompts (see gencache.py); REUSE is the chance a
+# cached reply is served instead of asking the model again.
+GENERATION_CACHE_SIZE = int(os.getenv("GENERATION_CACHE_SIZE", "256"))
+GENERATION_CACHE_TTL = float(os.getenv("GENERATION_CACHE_TTL", "3600"))
+GENERATION_CACHE_REUSE = float(os.getenv("GENERATION_CACHE_REUSE", "0.25"))
+
+# Provocations live in an append-only log; provocations.json is only read
+# once, to seed the log the first time the app starts. Rating stats are
+# kept up to date as the store reads each vote from the log.
+rating_stats = RatingStats()
+store = ProvocationStore(PROVOCATIONS_LOG, legacy_path=PROVOCATIONS_FILE,
+                         listeners=[rating_stats])
 
 API_KEY = os.getenv("GOOGLE_API_KEY")
 if API_KEY:
@@ -22,22 +66,16 @@ if API_KEY:
 
 def load_json_file(filename):
     try:
-        with open(filename, 'r', encoding='utf-8') as f:
+        with metrics.span('load_json_file'), open(filename, 'r', encoding='utf-8') as f:
             return json.load(f)
     except (FileNotFoundError, json.JSONDecodeError):
         return [] if filename == PROVOCATIONS_FILE else {}
 
-def save_provocations(provocations):
-    with open(PROVOCATIONS_FILE, 'w', encoding='utf-8') as f:
-        json.dump(provocations, f, indent=2, ensure_ascii=False)
+# Parsed and pre-serialised copies of the static JSON files, refreshed
+# whenever a file's mtime or size changes.
+file_cache = JSONFileCache(load_json_file)
 
-@app.route('/')
-def index():
-    return render_template('index.html')
-
-@app.route('/api/thinkers')
-def get_thinkers():
-    data = load_json_file(THINKERS_FILE)
+def thinkers_for_frontend(data):
     # Convert array format to dictionary format for the frontend
     if isinstance(data, dict) and 'thinkers' in data:
         thinkers_dict = {}
@@ -48,87 +86,378 @@ def get_thinkers():
                 'themes': [],
                 'keywords': []
             }
-        return jsonify(thinkers_dict)
-    return jsonify(data)
+        return thinkers_dict
+    return data
+
+def sampling_weights():
+    # With feedback_weighting on in config.json, well-rated thinkers and
+    # seeds are picked more often
+    if file_cache.get(CONFIG_FILE).data.get('feedback_weighting'):
+        return rating_stats
+    return None
+
+prompt_builder = PromptBuilder(file_cache, THINKERS_FILE, SEEDS_FILE, PROMPT_FILE,
+                               weights=sampling_weights)
+
+def resolve_mix(thinker=None, seed=None):
+    """Check the requested thinker/seed ids and return their pool mix."""
+    for kind, value in (('thinker', thinker), ('seed', seed)):
+        if value is not None and not isinstance(value, str):
+            raise UnknownChoice(f"{kind} must be a string id")
+    prompt_builder.build(thinker, seed)  # raises UnknownChoice for bad ids
+    return mix_key(thinker and prompt_builder.thinker_id(thinker), seed)
+
+generation_cache = GenerationCache(max_size=GENERATION_CACHE_SIZE, ttl=GENERATION_CACHE_TTL,
+                                   reuse=GENERATION_CACHE_REUSE)
+
+def cached_generate(full_prompt, reuse=None, coalesce=True):
+    return generation_cache.get_or_generate(
+        MODEL_NAME, full_prompt, lambda: generate_record(full_prompt),
+        reuse=reuse, coalesce=coalesce)
+
+def generate_for_mix(mix=ANY_MIX, reuse=None, coalesce=True):
+    prompt = prompt_builder.build(*parse_mix(mix))
+    result = cached_generate(prompt.text, reuse=reuse, coalesce=coalesce)
+    result['thinker'] = prompt.thinker
+    result['seed'] = prompt.seed
+    result['seed_id'] = prompt.seed_id
+    return result
+
+def refill_mix(mix):
+    # The pool and batches exist to hold different provocations, so never
+    # reuse a reply or share one with a concurrent call for the same prompt
+    return generate_for_mix(mix, reuse=0.0, coalesce=False)
+
+def resolve_spec(spec):
+    """Check a batch sampling spec and return it with thinkers as slugs."""
+    for kind in ('thinkers', 'seeds'):
+        values = spec.get(kind) or []
+        if not isinstance(values, list) or not all(isinstance(v, str) for v in values):
+            raise UnknownChoice(f"{kind} must be a list of string ids")
+    thinkers = [prompt_builder.thinker_id(thinker) for thinker in spec.get('thinkers') or []]
+    seeds = list(spec.get('seeds') or [])
+    for thinker in thinkers or [None]:
+        for seed in seeds or [None]:
+            prompt_builder.build(thinker, seed)  # raises UnknownChoice for bad ids
+    return {'thinkers': thinkers, 'seeds': seeds}
+
+pool = ProvocationPool(POOL_DIR, refill_mix,
+                       low=POOL_LOW_WATERMARK, high=POOL_HIGH_WATERMARK,
+                       idle=POOL_IDLE_EXPIRY, legacy_path=LEGACY_POOL_FILE)
+
+@app.before_request
+def start_pool():
+    # Started lazily so each gunicorn worker gets its own thread after forking
+    if POOL_ENABLED and model_available():
+        pool.start()
+
+if metrics.METRICS_ENABLED:
+    @app.before_request
+    def start_timer():
+        request.started_at = time.perf_counter()
+
+    @app.after_request
+    def record_request_time(response):
+        # Observed when the server closes the response, so a streamed one is
+        # timed to its last byte rather than to its headers
+        started_at = request.started_at
+        labels = {'endpoint': request.endpoint or 'unknown', 'method': request.method,
+                  'status': response.status_code}
+        response.call_on_close(lambda: metrics.request_seconds.observe(
+            time.perf_counter() - started_at, **labels))
+        return response
+
+def cached_response(entry):
+    response = app.response_class(entry.body, mimetype='application/json')
+    response.set_etag(entry.etag)
+    response.last_modified = entry.last_modified
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+@app.route('/')
+def index():
+    return render_template('index.html')
+
+@app.route('/api/thinkers')
+def get_thinkers():
+    return cached_response(file_cache.get(THINKERS_FILE, thinkers_for_frontend))
+
+def parse_timestamp(value, end_of_day=False):
+    """Check an ISO date/time query value; a bare date can mean the end of that day."""
+    if not value:
+        return None
+    datetime.fromisoformat(value)  # raises ValueError if malformed
+    if end_of_day and 'T' not in value:
+        value += 'T23:59:59.999999'
+    return value
+
+def json_stream(records, next_cursor, gzip=False):
+    """Serialise a page one record at a time, gzipping on the fly if asked."""
+    compressor = zlib.compressobj(wbits=31) if gzip else None
+
+    def pieces():
+        yield '{"items":['
+        for i, record in enumerate(records):
+            yield (',' if i else '') + json.dumps(record, ensure_ascii=False)
+        yield '],"next_cursor":' + json.dumps(next_cursor) + '}'
+
+    for piece in pieces():
+        data = piece.encode('utf-8')
+        if compressor:
+            data = compressor.compress(data)
+        if data:
+            yield data
+    if compressor:
+        yield compressor.flush()
 
 @app.route('/api/provocations')
 def get_provocations():
-    return jsonify(load_json_file(PROVOCATIONS_FILE))
+    """Newest-first page of provocations.
+
+    Query: cursor (from the previous page's next_cursor), limit, fields
+    (comma-separated), thinker (slug or name), since/until (ISO date or
+    time) and min_rating (average vote).
+    """
+    args = request.args
+    try:
+        cursor = int(args['cursor']) if args.get('cursor') else None
+        limit = min(max(int(args.get('limit', PAGE_SIZE)), 1), MAX_PAGE_SIZE)
+        min_rating = float(args['min_rating']) if args.get('min_rating') else None
+        since = parse_timestamp(args.get('since'))
+        until = parse_timestamp(args.get('until'), end_of_day=True)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid query: {e}"}), 400
+    thinker = args.get('thinker')
+    if thinker:
+        try:
+            thinker = prompt_builder.thinker(thinker).name
+        except UnknownChoice:
+            pass  # maybe a thinker that has since been removed from thinkers.json
+    
+    records, next_cursor = store.page(cursor, limit, thinker=thinker, since=since,
+                                      until=until, min_rating=min_rating)
+    if args.get('fields'):
+        fields = set(args['fields'].split(',')) | {'id'}
+        records = [{k: v for k, v in record.items() if k in fields} for record in records]
+    
+    gzip = 'gzip' in request.headers.get('Accept-Encoding', '')
+    response = app.response_class(json_stream(records, next_cursor, gzip),
+                                  mimetype='application/json')
+    response.vary.add('Accept-Encoding')
+    if gzip:
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
 
 @app.route('/api/seeds')
 def get_seeds():
-    return jsonify(load_json_file(SEEDS_FILE))
+    return cached_response(file_cache.get(SEEDS_FILE))
 
 @app.route('/api/prompt')
 def get_prompt():
-    return jsonify(load_json_file(PROMPT_FILE))
+    return cached_response(file_cache.get(PROMPT_FILE))
 
 @app.route('/api/config')
 def get_config():
-    return jsonify(load_json_file(CONFIG_FILE))
+    return cached_response(file_cache.get(CONFIG_FILE))
+
+@app.route('/api/bootstrap')
+def get_bootstrap():
+    # Everything the page needs on load, in one response
+    return cached_response(file_cache.bundle({
+        'thinkers': file_cache.get(THINKERS_FILE, thinkers_for_frontend),
+        'seeds': file_cache.get(SEEDS_FILE),
+        'prompt': file_cache.get(PROMPT_FILE),
+        'config': file_cache.get(CONFIG_FILE),
+    }))
 
 @app.route('/api/generate', methods=['POST'])
 def generate_provocation():
-    if not API_KEY:
+    if not model_available():
         return jsonify({"error": "API key not configured"}), 500
     
     data = request.json
-    if not data:
+    if data is None:
         return jsonify({"error": "No JSON data provided"}), 400
-    
-    system_prompt = data.get('systemPrompt', '')
-    user_prompt = data.get('userPrompt', '')
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
     
     try:
-        model = genai.GenerativeModel('gemini-1.5-flash')
-        
-        # Combine system and user prompts
-        full_prompt = f"{system_prompt}\n\n{user_prompt}"
-        
-        response = model.generate_content(full_prompt)
-        
-        if response.text:
-            # Try to extract JSON from the response
-            response_text = response.text.strip()
-            # If the response has markdown code blocks, extract the JSON
-            if '```json' in response_text:
-                response_text = response_text.split('```json')[1].split('```')[0].strip()
-            elif '```' in response_text:
-                response_text = response_text.split('```')[1].split('```')[0].strip()
-            
-            try:
-                result = json.loads(response_text)
-            except json.JSONDecodeError:
-                return jsonify({"error": "Invalid JSON response from AI"}), 500
-            
-            # Validate result structure
-            if not isinstance(result, dict) or 'provocation' not in result:
-                return jsonify({"error": "Invalid response format from AI"}), 500
-            
-            # Save to provocations file if it looks valid
-            if 'provocation' in result:
-                provocations = load_json_file(PROVOCATIONS_FILE)
-                if not isinstance(provocations, list):
-                    provocations = []
-                provocations.append(result)
-                save_provocations(provocations)
-            
-            return jsonify(result)
+        if 'systemPrompt' in data or 'userPrompt' in data:
+            # Combine system and user prompts sent by the page
+            system_prompt = data.get('systemPrompt', '')
+            user_prompt = data.get('userPrompt', '')
+            result = cached_generate(f"{system_prompt}\n\n{user_prompt}")
         else:
-            return jsonify({"error": "No response from AI"}), 500
-            
+            # Build the prompt here, serving a pre-generated one if the pool has
+            # it (requests naming a seed are never pooled)
+            try:
+                mix = resolve_mix(data.get('thinker'), data.get('seed'))
+            except UnknownChoice as e:
+                return jsonify({"error": str(e)}), 400
+            result = pool.pop(mix) if POOL_ENABLED else None
+            if result is None:
+                result = generate_for_mix(mix)
+    except GenerationError as e:
+        return jsonify({"error": str(e)}), 500
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
         print(f"Error generating provocation: {e}")
         print(f"Traceback: {error_detail}")
         return jsonify({"error": str(e), "detail": error_detail}), 500
+    
+    # Save to the provocation store; the id is what /api/vote takes
+    result['id'] = store.add(result)
+    return jsonify(result)
+
+STREAMED_FIELDS = ('provocation', 'task')
+
+def sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@app.route('/api/generate/stream')
+def stream_provocation():
+    """Server-sent events: `provocation` and `task` as soon as each is complete,
+    then `done` with the saved record (or `error`)."""
+    if not model_available():
+        return jsonify({"error": "API key not configured"}), 500
+    try:
+        mix = resolve_mix(request.args.get('thinker'), request.args.get('seed'))
+    except UnknownChoice as e:
+        return jsonify({"error": str(e)}), 400
+
+    def events():
+        try:
+            result = pool.pop(mix) if POOL_ENABLED else None
+            if result is not None:
+                for field in STREAMED_FIELDS:
+                    if field in result:
+                        yield sse(field, {field: result[field]})
+            else:
+                prompt = prompt_builder.build(*parse_mix(mix))
+                for field, value in stream_record(prompt.text):
+                    if field is None:
+                        result = value
+                    elif field in STREAMED_FIELDS:
+                        yield sse(field, {field: value})
+                result['thinker'] = prompt.thinker
+                result['seed'] = prompt.seed
+                result['seed_id'] = prompt.seed_id
+        except GenerationError as e:
+            yield sse('error', {"error": str(e)})
+            return
+        except Exception as e:
+            import traceback
+            print(f"Error streaming provocation: {e}")
+            print(f"Traceback: {traceback.format_exc()}")
+            yield sse('error', {"error": str(e)})
+            return
+        result['id'] = store.add(result)
+        yield sse('done', result)
+
+    return app.response_class(stream_with_context(events()), mimetype='text/event-stream',
+                              headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/generate/batch', methods=['POST'])
+def start_batch():
+    """Start (or resume, given `run_id`) a batch run in the background.
+
+    One batch runs at a time across all workers (409 otherwise), at no more
+    than BATCH_MAX_RATE model calls per second.
+    """
+    if not model_available():
+        return jsonify({"error": "API key not configured"}), 500
+    
+    data = request.json
+    if data is None:
+        return jsonify({"error": "No JSON data provided"}), 400
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
+    
+    workers = data.get('workers', 4)
+    rate = data.get('rate', 1.0)
+    if not isinstance(workers, int) or workers < 1:
+        return jsonify({"error": "workers must be a positive integer"}), 400
+    if not isinstance(rate, (int, float)) or rate < 0:
+        return jsonify({"error": "rate must be a number of calls per second (0 = the maximum)"}), 400
+    rate = min(rate or BATCH_MAX_RATE, BATCH_MAX_RATE)
+    
+    run_id = data.get('run_id')
+    if run_id:
+        if run_status(run_id) is None:
+            return jsonify({"error": "Unknown run id"}), 404
+        spec, n = None, 0
+    else:
+        n = data.get('n')
+        if not isinstance(n, int) or not 0 < n <= BATCH_MAX_ITEMS:
+            return jsonify({"error": f"n must be between 1 and {BATCH_MAX_ITEMS}"}), 400
+        try:
+            spec = resolve_spec(data)
+        except UnknownChoice as e:
+            return jsonify({"error": str(e)}), 400
+    
+    slot = BatchSlot()
+    try:
+        slot.claim()
+    except RunBusy as e:
+        return jsonify({"error": f"{e}; try again when it has finished"}), 409
+    try:
+        run = BatchRun(refill_mix, store, n=n, spec=spec, run_id=run_id,
+                       workers=min(workers, BATCH_MAX_WORKERS), rate=rate)
+    except Exception:
+        slot.release()
+        raise
+    
+    def work():
+        try:
+            run.run()
+        except RunBusy:
+            print(f"Batch {run.run_id} is already running")
+        finally:
+            slot.release()
+    
+    threading.Thread(target=work, name=f'batch-{run.run_id}', daemon=True).start()
+    return jsonify(run_status(run.run_id)), 202
+
+@app.route('/api/generate/batch/<run_id>')
+def get_batch(run_id):
+    status = run_status(run_id)
+    if status is None:
+        return jsonify({"error": "Unknown run id"}), 404
+    return jsonify(status)
+
+@app.route('/api/generate/cache')
+def get_generation_cache_stats():
+    return jsonify(generation_cache.stats())
+
+@app.route('/api/stats')
+def get_stats():
+    """Vote totals per thinker, seed and pair, or for one provocation with ?id=N."""
+    store.sync()
+    if 'id' in request.args:
+        try:
+            provocation_id = int(request.args['id'])
+        except ValueError:
+            return jsonify({"error": "id must be an integer"}), 400
+        summary = rating_stats.provocation(provocation_id)
+        if summary is None:
+            return jsonify({"error": "No votes for this provocation"}), 404
+        return jsonify(summary)
+    return jsonify(rating_stats.snapshot())
+
+@app.route('/metrics')
+def get_metrics():
+    if not metrics.METRICS_ENABLED:
+        return jsonify({"error": "Metrics are disabled (set METRICS_ENABLED=1)"}), 404
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
 
 @app.route('/api/vote', methods=['POST'])
 def vote():
     data = request.json
     if not data:
         return jsonify({"error": "No JSON data provided"}), 400
+    if not isinstance(data, dict):
+        return jsonify({"error": "Expected a JSON object"}), 400
         
     provocation_id = data.get('id')
     vote_value = data.get('vote')
@@ -137,25 +466,19 @@ def vote():
     if provocation_id is None or vote_value is None:
         return jsonify({"error": "Missing id or vote"}), 400
     
-    provocations = load_json_file(PROVOCATIONS_FILE)
-    if not isinstance(provocations, list):
-        return jsonify({"error": "Invalid provocations data structure"}), 500
+    # bool is an int subclass, so true/false would pass as 1/0 otherwise
+    if not isinstance(provocation_id, int) or isinstance(provocation_id, bool):
+        return jsonify({"error": "Invalid provocation id"}), 400
+    if isinstance(vote_value, bool) or vote_value not in (1, -1):
+        return jsonify({"error": "vote must be 1 or -1"}), 400
     
-    if 0 <= provocation_id < len(provocations):
-        # Initialize feedback structure if it doesn't exist
-        if 'feedback' not in provocations[provocation_id]:
-            provocations[provocation_id]['feedback'] = []
-        
-        # Add new feedback entry
-        from datetime import datetime
-        feedback_entry = {
-            'rating': vote_value,
-            'comment': comment,
-            'timestamp': datetime.now().isoformat()
-        }
-        provocations[provocation_id]['feedback'].append(feedback_entry)
-        
-        save_provocations(provocations)
+    # Add new feedback entry
+    feedback_entry = {
+        'rating': vote_value,
+        'comment': comment,
+        'timestamp': datetime.now().isoformat()
+    }
+    if store.add_feedback(provocation_id, feedback_entry):
         return jsonify({"success": True})
     
     return jsonify({"error": "Invalid provocation id"}), 400
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+Generating many provocations at once, e.g. to pre-seed a workshop.
+
+A batch run samples N (thinker, seed) mixes from a spec and generates them
+on a small thread pool, rate limited and retrying with backoff when Gemini
+says the quota is used up. Each result is appended to the run's own JSONL
+file as it arrives, and everything is added to the provocation store in one
+write at the end. Because the run file records which items are done and
+which were committed, an interrupted run can be resumed by its id.
+
+A "committing" line goes down just before the store write and a
+"committed" line just after it. If a run died in between, resuming looks
+for those items among the records the store got since the "committing"
+line rather than adding them a second time.
+
+Run file layout (batches/<run_id>.jsonl):
+
+    {"run": "<run_id>", "n": 100, "spec": {...}, "mixes": [...]}   header
+    {"item": 7, "record": {...}}                  one per generated item
+    {"committing": [0, 1, ...], "at": "..."}      before each store write
+    {"committed": [0, 1, ...], "ids": [...]}      after it
+"""
+import json
+import os
+import random
+import re
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from prompts import mix_key
+from store import fcntl
+
+try:
+    from google.api_core import exceptions as google_exceptions
+    RETRYABLE = (google_exceptions.ResourceExhausted, google_exceptions.TooManyRequests,
+                 google_exceptions.ServiceUnavailable, google_exceptions.DeadlineExceeded)
+except ImportError:
+    RETRYABLE = ()
+
+BATCH_DIR = "batches"
+
+
+class RunBusy(Exception):
+    """The run, or the server's batch slot, is taken by another thread or process."""
+
+
+class RateLimiter:
+    """Allow at most `rate` calls per second across all threads (0 = unlimited)."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = time.monotonic()
+        self._lock = threading.Lock()
+
+    def wait(self):
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            start = max(now, self._next)
+            self._next = start + self.interval
+        time.sleep(start - now)
+
+
+class BatchSlot:
+    """The server's one batch slot, shared by every worker process.
+
+    claim() raises RunBusy while another batch holds it. release() frees it
+    and may be called from a different thread than claim().
+    """
+    _local = threading.Lock()  # stands in for flock where fcntl is missing
+
+    def __init__(self, batch_dir=BATCH_DIR):
+        self.batch_dir = batch_dir
+        self._file = None
+
+    def claim(self):
+        os.makedirs(self.batch_dir, exist_ok=True)
+        f = open(os.path.join(self.batch_dir, 'active.lock'), 'a')
+        try:
+            if fcntl:
+                fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            elif not self._local.acquire(blocking=False):
+                raise OSError
+        except OSError:
+            f.close()
+            raise RunBusy("another batch is running")
+        self._file = f
+
+    def release(self):
+        if not fcntl:
+            self._local.release()
+        self._file.close()  # closing the file drops the flock
+
+
+def is_retryable(error):
+    return isinstance(error, RETRYABLE) or '429' in str(error) or 'quota' in str(error).lower()
+
+
+def sample_mixes(n, spec, rng=random):
+    """Pick N pool-style mixes from a spec like {"thinkers": [...], "seeds": [...]}.
+
+    Each item takes a random thinker and seed from the given lists; a missing
+    or empty list leaves that choice to the weighted tables at generation time.
+    """
+    thinkers = spec.get('thinkers') or [None]
+    seeds = spec.get('seeds') or [None]
+    return [mix_key(rng.choice(thinkers), rng.choice(seeds)) for _ in range(n)]
+
+
+def valid_run_id(run_id):
+    return isinstance(run_id, str) and bool(re.fullmatch(r'[A-Za-z0-9_-]{1,64}', run_id))
+
+
+def run_path(run_id, batch_dir=BATCH_DIR):
+    if not valid_run_id(run_id):
+        raise ValueError(f"Invalid run id: {run_id}")
+    return os.path.join(batch_dir, f"{run_id}.jsonl")
+
+
+def read_run(run_id, batch_dir=BATCH_DIR):
+    """Return (header, {item: record}, committed items, last "committing" line), or None."""
+    if not valid_run_id(run_id):
+        return None
+    try:
+        f = open(run_path(run_id, batch_dir), 'r', encoding='utf-8')
+    except FileNotFoundError:
+        return None
+    header, records, committed, committing = None, {}, set(), None
+    with f:
+        for raw in f:
+            if not raw.endswith('\n'):
+                break
+            line = json.loads(raw)
+            if 'run' in line:
+                header = line
+            elif 'item' in line:
+                records[line['item']] = line['record']
+            elif 'committing' in line:
+                committing = line
+            elif 'committed' in line:
+                committed.update(line['committed'])
+    return header, records, committed, committing
+
+
+def run_status(run_id, batch_dir=BATCH_DIR):
+    run = read_run(run_id, batch_dir)
+    if run is None:
+        return None
+    header, records, committed, _ = run
+    return {
+        'run_id': run_id,
+        'n': header['n'],
+        'spec': header['spec'],
+        'done': len(records),
+        'committed': len(committed),
+        'complete': len(committed) == header['n'],
+    }
+
+
+class BatchRun:
+    def __init__(self, generate, store, n=0, spec=None, run_id=None, workers=4, rate=1.0,
+                 retries=5, backoff=2.0, batch_dir=BATCH_DIR, progress=None):
+        # `generate(mix)` returns one provocation dict; `progress(done, failed, total)`
+        # is called after every item.
+        self.generate = generate
+        self.store = store
+        self.workers = max(1, workers)
+        self.limiter = RateLimiter(rate)
+        self.retries = retries
+        self.backoff = backoff
+        self.batch_dir = batch_dir
+        self.progress = progress
+        self._write_lock = threading.Lock()
+        os.makedirs(batch_dir, exist_ok=True)
+
+        if run_id and os.path.exists(run_path(run_id, batch_dir)):
+            header = read_run(run_id, batch_dir)[0]
+            self.run_id, self.n, self.spec = run_id, header['n'], header['spec']
+            self.mixes = header['mixes']
+        else:
+            self.run_id = run_id or uuid.uuid4().hex[:12]
+            self.n, self.spec = n, spec or {}
+            self.mixes = sample_mixes(n, self.spec)
+            self._write({'run': self.run_id, 'n': self.n, 'spec': self.spec, 'mixes': self.mixes})
+
+    @property
+    def path(self):
+        return run_path(self.run_id, self.batch_dir)
+
+    def _write(self, line):
+        with self._write_lock, open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(line, ensure_ascii=False) + '\n')
+
+    def _generate_one(self, mix):
+        for attempt in range(self.retries + 1):
+            self.limiter.wait()
+            try:
+                return self.generate(mix)
+            except Exception as e:
+                if attempt == self.retries or not is_retryable(e):
+                    raise
+                time.sleep(self.backoff * 2 ** attempt * (1 + random.random()))
+
+    def run(self):
+        """Generate whatever is still missing, then commit it to the store.
+
+        Returns the run's status dict. Raises RunBusy if another thread or
+        process is already working on this run.
+        """
+        with open(self.path + '.lock', 'a') as lock:
+            if fcntl:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except OSError:
+                    raise RunBusy(self.run_id)
+            self._run()
+        return run_status(self.run_id, self.batch_dir)
+
+    def _run(self):
+        _, records, committed, _ = read_run(self.run_id, self.batch_dir)
+        todo = [item for item in range(self.n) if item not in records]
+        done, failed = len(records), 0
+        counter_lock = threading.Lock()
+
+        def work(item):
+            nonlocal done, failed
+            try:
+                record = self._generate_one(self.mixes[item])
+            except Exception as e:
+                print(f"Batch {self.run_id}: item {item} failed: {e}")
+                with counter_lock:
+                    failed += 1
+            else:
+                self._write({'item': item, 'record': record})
+                with counter_lock:
+                    done += 1
+            if self.progress:
+                self.progress(done, failed, self.n)
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            list(executor.map(work, todo))
+
+        # One store write for everything generated but not yet committed
+        _, records, committed, committing = read_run(self.run_id, self.batch_dir)
+        if committing:
+            committed |= self._recover(records, committed, committing)
+        pending = sorted(item for item in records if item not in committed)
+        if pending:
+            self._write({'committing': pending, 'at': datetime.now().isoformat()})
+            ids = self.store.add_many([records[item] for item in pending])
+            self._write({'committed': pending, 'ids': ids})
+
+    def _recover(self, records, committed, committing):
+        """Find items of an interrupted store write that did reach the store.
+
+        Only records created since the "committing" line are looked at, so
+        this costs as much as the history added after the crash. Returns the
+        items found, after marking them committed.
+        """
+        wanted = {item: records[item] for item in committing['committing']
+                  if item not in committed}
+        found = {}
+        cursor = None
+        while wanted:
+            page, cursor = self.store.page(cursor, limit=200, since=committing['at'])
+            for stored in page:
+                data = {k: v for k, v in stored.items()
+                        if k not in ('id', 'created_at', 'feedback')}
+                item = next((item for item, record in wanted.items() if record == data), None)
+                if item is not None:
+                    found[item] = stored['id']
+                    del wanted[item]
+            if cursor is None:
+                break
+        if found:
+            items = sorted(found)
+            self._write({'committed': items, 'ids': [found[item] for item in items]})
+        return set(found)
@@ -0,0 +1,198 @@
+#!/usr/bin/env python3
+"""
+Load-test the app under gunicorn against the offline stand-in model.
+
+For each history size, a scratch folder gets copies of the JSON files plus a
+provocations.json with that many synthetic records; gunicorn is started on
+it with FAKE_MODEL=1 and every endpoint is hammered in turn. The report
+shows p50/p99 latency and throughput per endpoint and size, so a slowdown
+that only appears once history grows is easy to spot.
+
+    python benchmark.py
+    python benchmark.py --sizes 100,100000 --requests 500 --concurrency 16
+    python benchmark.py --json > bench_output.txt
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_FILES = ("thinkers.json", "seeds.json", "prompt.json", "config.json")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def write_history(path, size, rng):
+    """A provocations.json with `size` records, some of them voted on."""
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write('[')
+        for i in range(size):
+            record = {
+                'provocation': f"Synthetic provocation number {i}.",
+                'task': "Walk to the nearest corner and count every red object you pass.",
+            }
+            if rng.random() < 0.3:
+                record['feedback'] = [{'rating': rng.choice((1, -1)), 'comment': '',
+                                       'timestamp': '2025-01-01T00:00:00'}]
+            f.write((',' if i else '') + json.dumps(record))
+        f.write(']')
+
+
+class Server:
+    def __init__(self, folder, workers, threads, latency):
+        self.port = free_port()
+        env = dict(os.environ, FAKE_MODEL='1', FAKE_MODEL_LATENCY=str(latency),
+                   POOL_ENABLED='0', GENERATION_CACHE_REUSE='0', GUNICORN_THREADS=str(threads))
+        self.process = subprocess.Popen(
+            [sys.executable, '-m', 'gunicorn', '-c', os.path.join(HERE, 'gunicorn.conf.py'),
+             '--workers', str(workers), '--bind', f'127.0.0.1:{self.port}',
+             '--chdir', folder, '--pythonpath', HERE, '--log-level', 'info', 'wsgi:app'],
+            env=env, stderr=subprocess.PIPE, text=True)
+
+    def url(self, path):
+        return f'http://127.0.0.1:{self.port}{path}'
+
+    def wait(self, workers, timeout=120):
+        """Wait until every worker has indexed history and is taking requests.
+
+        gunicorn.conf.py logs "Worker ready" for each one; waiting only for
+        the first would measure the others still booting on the same CPUs.
+        """
+        deadline = time.time() + timeout
+        ready = 0
+        for line in self.process.stderr:
+            if 'Worker ready' in line:
+                ready += 1
+                if ready == workers:
+                    break
+            if time.time() > deadline:
+                raise RuntimeError("gunicorn did not start")
+        if ready < workers:
+            raise RuntimeError("gunicorn exited during startup")
+        # Keep draining the log so gunicorn never blocks writing to it
+        threading.Thread(target=lambda: [None for _ in self.process.stderr], daemon=True).start()
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+def request(url, body=None):
+    data = json.dumps(body).encode('utf-8') if body is not None else None
+    req = urllib.request.Request(url, data=data, headers={'Content-Type': 'application/json'})
+    start = time.perf_counter()
+    with urllib.request.urlopen(req, timeout=60) as response:
+        response.read()
+    return time.perf_counter() - start
+
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))]
+
+
+def load(server, name, make_request, count, concurrency):
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def one(_):
+        nonlocal errors
+        try:
+            elapsed = make_request()
+        except OSError:
+            with lock:
+                errors += 1
+            return
+        with lock:
+            latencies.append(elapsed)
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, range(count)))
+    wall = time.perf_counter() - start
+    return {
+        'endpoint': name,
+        'requests': count,
+        'errors': errors,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2) if latencies else None,
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2) if latencies else None,
+        'rps': round(len(latencies) / wall, 1),
+    }
+
+
+def bench_size(size, args, rng):
+    folder = tempfile.mkdtemp(prefix=f'creative-acts-bench-{size}-')
+    try:
+        for name in DATA_FILES:
+            shutil.copy(os.path.join(HERE, name), folder)
+        write_history(os.path.join(folder, 'provocations.json'), size, rng)
+        server = Server(folder, args.workers, args.threads, args.latency)
+        try:
+            started = time.perf_counter()
+            server.wait(args.workers)
+            startup = time.perf_counter() - started
+            endpoints = {
+                'generate': lambda: request(server.url('/api/generate'), {}),
+                'vote': lambda: request(server.url('/api/vote'),
+                                        {'id': rng.randrange(size), 'vote': rng.choice((1, -1))}),
+                'provocations': lambda: request(server.url('/api/provocations?limit=50')),
+                'bootstrap': lambda: request(server.url('/api/bootstrap')),
+                'stats': lambda: request(server.url('/api/stats')),
+            }
+            results = [dict(load(server, name, make_request, args.requests, args.concurrency),
+                            size=size)
+                       for name, make_request in endpoints.items() if name in args.endpoints]
+            return startup, results
+        finally:
+            server.stop()
+    finally:
+        shutil.rmtree(folder, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the app under gunicorn.")
+    parser.add_argument('--sizes', default='100,1000,10000,100000',
+                        help="comma-separated history sizes (records in provocations.json)")
+    parser.add_argument('--requests', type=int, default=200, help="requests per endpoint")
+    parser.add_argument('--concurrency', type=int, default=8, help="concurrent clients")
+    parser.add_argument('--workers', type=int, default=3, help="gunicorn workers")
+    parser.add_argument('--threads', type=int, default=8, help="threads per gunicorn worker")
+    parser.add_argument('--latency', type=float, default=0.05, help="stand-in model latency (s)")
+    parser.add_argument('--endpoints', default='generate,vote,provocations,bootstrap,stats',
+                        help="comma-separated endpoints to test")
+    parser.add_argument('--json', action='store_true', help="print results as JSON lines")
+    args = parser.parse_args()
+    args.endpoints = args.endpoints.split(',')
+
+    rng = random.Random(0)
+    if not args.json:
+        print(f"{'size':>8} {'endpoint':<14} {'p50 ms':>9} {'p99 ms':>9} {'req/s':>9} {'errors':>7}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        startup, results = bench_size(size, args, rng)
+        for result in results:
+            if args.json:
+                print(json.dumps(dict(result, startup_s=round(startup, 2))))
+            else:
+                print(f"{size:>8} {result['endpoint']:<14} {result['p50_ms']:>9} "
+                      f"{result['p99_ms']:>9} {result['rps']:>9} {result['errors']:>7}")
+        if not args.json:
+            print(f"{size:>8} {'(startup)':<14} {startup * 1000:>9.0f}")
+        sys.stdout.flush()
+
+
+if __name__ == '__main__':
+    main()
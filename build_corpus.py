@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+Build a corpus of provocations from the command line, e.g. before a workshop.
+
+    python build_corpus.py -n 200
+    python build_corpus.py -n 50 --thinker the-dadaist --seed seeds/3 --rate 2
+    python build_corpus.py --resume 1a2b3c4d5e6f
+    python build_corpus.py -n 20 --fake          # offline, no API key needed
+
+Results are appended to batches/<run_id>.jsonl as they arrive and added to
+the provocation store in one write at the end. If a run is interrupted,
+resume it with the run id printed at the start.
+"""
+import argparse
+import os
+import sys
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate many provocations at once.")
+    parser.add_argument('-n', type=int, default=0, help="how many provocations to generate")
+    parser.add_argument('--thinker', action='append', default=[],
+                        help="thinker slug or name to sample from (repeatable; default: any)")
+    parser.add_argument('--seed', action='append', default=[],
+                        help="seed id to sample from (repeatable; default: any)")
+    parser.add_argument('--workers', type=int, default=4, help="concurrent model calls")
+    parser.add_argument('--rate', type=float, default=1.0, help="max model calls per second (0 = unlimited)")
+    parser.add_argument('--retries', type=int, default=5, help="retries per item on quota errors")
+    parser.add_argument('--resume', metavar='RUN_ID', help="continue an earlier run")
+    parser.add_argument('--fake', action='store_true', help="use the offline stand-in model")
+    args = parser.parse_args()
+
+    if not args.resume and args.n <= 0:
+        parser.error("give -n or --resume")
+    if args.fake:
+        # Must be set before the app (and generation.py) is imported
+        os.environ['FAKE_MODEL'] = '1'
+
+    from app import refill_mix, resolve_spec, store
+    from batch import BatchRun, RunBusy, run_status
+    from generation import model_available
+    from prompts import UnknownChoice
+
+    if not model_available():
+        sys.exit("GOOGLE_API_KEY is not set (or use --fake)")
+    if args.resume and run_status(args.resume) is None:
+        sys.exit(f"Unknown run id: {args.resume}")
+    try:
+        spec = None if args.resume else resolve_spec({'thinkers': args.thinker, 'seeds': args.seed})
+    except UnknownChoice as e:
+        sys.exit(str(e))
+
+    def progress(done, failed, total):
+        print(f"\r{done}/{total} done, {failed} failed", end='', file=sys.stderr, flush=True)
+
+    run = BatchRun(refill_mix, store, n=args.n, spec=spec, run_id=args.resume,
+                   workers=args.workers, rate=args.rate, retries=args.retries, progress=progress)
+    print(f"Run {run.run_id}", file=sys.stderr)
+    try:
+        status = run.run()
+    except RunBusy:
+        sys.exit(f"Run {run.run_id} is already running")
+    print(file=sys.stderr)
+    print(f"{status['committed']}/{status['n']} provocations saved", file=sys.stderr)
+    if not status['complete']:
+        print(f"Resume with: python build_corpus.py --resume {run.run_id}", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
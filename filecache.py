@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+"""
+In-process cache for the small JSON files the app serves as-is.
+
+Each file is parsed and serialised once, then kept until its size or
+modification time changes, so editing thinkers.json still takes effect
+without a restart. Entries carry an ETag and Last-Modified time so the
+routes can answer conditional GETs with 304 Not Modified.
+"""
+import hashlib
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+
+def _serialise(data):
+    return json.dumps(data, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+class CachedFile:
+    def __init__(self, data, body, mtime):
+        self.data = data
+        self.body = body
+        self.etag = hashlib.sha1(body).hexdigest()
+        self.last_modified = datetime.fromtimestamp(mtime, timezone.utc) if mtime else None
+
+
+class JSONFileCache:
+    def __init__(self, loader):
+        # `loader` parses a file by name, e.g. app.load_json_file
+        self.loader = loader
+        self._entries = {}
+        self._bundles = {}
+        self._lock = threading.Lock()
+
+    def get(self, path, transform=None):
+        """Return the CachedFile for `path`, re-reading it only if it changed."""
+        try:
+            st = os.stat(path)
+            stamp = (st.st_mtime_ns, st.st_size)
+            mtime = st.st_mtime
+        except FileNotFoundError:
+            stamp = mtime = None
+        key = (path, transform)
+        cached = self._entries.get(key)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        data = self.loader(path)
+        if transform:
+            data = transform(data)
+        entry = CachedFile(data, _serialise(data), mtime)
+        with self._lock:
+            self._entries[key] = (stamp, entry)
+        return entry
+
+    def bundle(self, parts):
+        """Combine named CachedFiles into one JSON object, cached by their ETags."""
+        key = tuple((name, entry.etag) for name, entry in parts.items())
+        entry = self._bundles.get(key)
+        if entry:
+            return entry
+        body = b'{' + b','.join(_serialise(name) + b':' + part.body
+                                for name, part in parts.items()) + b'}'
+        entry = CachedFile({name: part.data for name, part in parts.items()}, body, None)
+        modified = [part.last_modified for part in parts.values() if part.last_modified]
+        entry.last_modified = max(modified) if modified else None
+        with self._lock:
+            # Only the bundle for the current file versions is worth keeping.
+            self._bundles = {key: entry}
+        return entry
@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Caching and coalescing model calls for identical prompts.
+
+Replies are cached under a hash of the model name and prompt, in a bounded
+LRU with a time-to-live. Because variety matters, a cached reply is only
+reused with probability `reuse` (0 = always ask the model again, 1 = reuse
+whenever possible). Independently of that, concurrent requests for the
+same prompt share one upstream call instead of each making their own,
+unless the caller needs a distinct reply (coalesce=False).
+
+The cache is per process; hit/miss/coalesced counts are kept for tuning.
+"""
+import hashlib
+import random
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class GenerationCache:
+    def __init__(self, max_size=256, ttl=3600.0, reuse=0.25):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.reuse = reuse
+        self._entries = OrderedDict()  # key -> (expires_at, result)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self.hits = self.misses = self.coalesced = self.evictions = 0
+
+    @staticmethod
+    def key(model_name, prompt):
+        return hashlib.sha256(f"{model_name}\0{prompt}".encode('utf-8')).hexdigest()
+
+    def get_or_generate(self, model_name, prompt, produce, reuse=None, coalesce=True):
+        """Return a reply for `prompt`, calling `produce()` only when needed.
+
+        With coalesce=False this call always gets its own upstream call,
+        even while an identical one is in flight (the reply is still cached).
+        """
+        reuse = self.reuse if reuse is None else reuse
+        key = self.key(model_name, prompt)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached and cached[0] < time.monotonic():
+                del self._entries[key]
+                cached = None
+            if cached and random.random() < reuse:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return dict(cached[1])
+            if not coalesce:
+                self.misses += 1
+                flight = None
+            else:
+                flight = self._inflight.get(key)
+                leader = flight is None
+                if leader:
+                    self.misses += 1
+                    flight = self._inflight[key] = _Flight()
+                else:
+                    self.coalesced += 1
+
+        if flight is None:
+            result = produce()
+            self._put(key, result)
+            return dict(result)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error:
+                raise flight.error
+            return dict(flight.result)
+
+        try:
+            flight.result = produce()
+        except Exception as e:
+            flight.error = e
+            raise
+        else:
+            self._put(key, flight.result)
+        finally:
+            with self._lock:
+                del self._inflight[key]
+            flight.done.set()
+        return dict(flight.result)
+
+    def _put(self, key, result):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(result))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'coalesced': self.coalesced,
+                'evictions': self.evictions,
+                'size': len(self._entries),
+                'max_size': self.max_size,
+                'ttl': self.ttl,
+                'reuse': self.reuse,
+            }
@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+"""
+Talking to the model: picking a client and turning its reply into a provocation.
+
+Set FAKE_MODEL=1 to swap Gemini for a local stand-in that needs no API key
+or network, e.g. to try the pool or run benchmarks offline.
+FAKE_MODEL_LATENCY (seconds) makes the stand-in as slow as a real call.
+"""
+import json
+import os
+import random
+import time
+
+import google.generativeai as genai
+
+import metrics
+
+MODEL_NAME = 'gemini-1.5-flash'
+
+FAKE_MODEL = os.getenv("FAKE_MODEL", "").lower() in ("1", "true", "yes")
+FAKE_MODEL_LATENCY = float(os.getenv("FAKE_MODEL_LATENCY", "0"))
+
+
+class GenerationError(Exception):
+    """The model answered, but not with a usable provocation."""
+
+
+class FakeResponse:
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeModel:
+    """Offline stand-in for genai.GenerativeModel."""
+
+    subjects = ["The pavement", "An empty chair", "The last bus", "A borrowed umbrella"]
+    verbs = ["remembers", "hums", "forgets", "rehearses"]
+    actions = [
+        "Walk to the nearest corner and count every red object you pass.",
+        "Leave a folded note with one word on it inside a library book.",
+        "Photograph the same doorway every hour until sunset.",
+        "Trace the outline of a shadow in chalk and wait for it to leave.",
+    ]
+
+    def __init__(self, model_name=MODEL_NAME, latency=None):
+        self.model_name = model_name
+        self.latency = FAKE_MODEL_LATENCY if latency is None else latency
+
+    def generate_content(self, prompt, stream=False):
+        result = {
+            "provocation": f"{random.choice(self.subjects)} {random.choice(self.verbs)} "
+                           f"what you walked past ({random.randrange(10**6)}).",
+            "task": random.choice(self.actions),
+        }
+        text = "```json\n" + json.dumps(result, indent=2) + "\n```"
+        if stream:
+            return self._stream(text)
+        time.sleep(self.latency)
+        return FakeResponse(text)
+
+    def _stream(self, text, chunks=8):
+        size = -(-len(text) // chunks)
+        for start in range(0, len(text), size):
+            time.sleep(self.latency / chunks)
+            yield FakeResponse(text[start:start + size])
+
+
+def model_available():
+    return FAKE_MODEL or bool(os.getenv("GOOGLE_API_KEY"))
+
+
+def get_model(model_name=MODEL_NAME):
+    if FAKE_MODEL:
+        return FakeModel(model_name)
+    return genai.GenerativeModel(model_name)
+
+
+def extract_json(text):
+    """Parse the JSON object out of a reply, which may be wrapped in a ``` block."""
+    response_text = text.strip()
+    # If the response has markdown code blocks, extract the JSON
+    if '```json' in response_text:
+        response_text = response_text.split('```json')[1].split('```')[0].strip()
+    elif '```' in response_text:
+        response_text = response_text.split('```')[1].split('```')[0].strip()
+    return json.loads(response_text)
+
+
+def parse_record(text):
+    """Turn the model's full reply into a provocation dict, or raise GenerationError."""
+    if not text:
+        raise GenerationError("No response from AI")
+    try:
+        result = extract_json(text)
+    except json.JSONDecodeError:
+        raise GenerationError("Invalid JSON response from AI")
+    # Validate result structure
+    if not isinstance(result, dict) or 'provocation' not in result:
+        raise GenerationError("Invalid response format from AI")
+    return result
+
+
+def _checked_parse(text):
+    with metrics.span('extract_json'):
+        try:
+            result = parse_record(text)
+        except GenerationError:
+            metrics.invalid_responses.inc()
+            raise
+    metrics.generations.inc()
+    return result
+
+
+def generate_record(full_prompt, model_name=MODEL_NAME):
+    """Run one prompt through the model and return the provocation dict."""
+    try:
+        with metrics.span('model_call'):
+            response = get_model(model_name).generate_content(full_prompt)
+            text = response.text
+    except Exception:
+        metrics.upstream_errors.inc()
+        raise
+    return _checked_parse(text)
+
+
+class FieldStream:
+    """Pick top-level string fields out of a JSON object while its text arrives.
+
+    feed() takes the next piece of text and returns the (key, value) pairs
+    that became complete with it. Anything before the opening brace (such as
+    a ```json fence) is skipped; nested values are stepped over.
+    """
+
+    def __init__(self):
+        self.buffer = ''
+        self.pos = 0
+        self.state = 'seek'
+        self.key = None
+        self.target = None
+        self.start = 0
+        self.nest = 0
+        self.in_string = False
+
+    def feed(self, text):
+        self.buffer += text
+        buf = self.buffer
+        fields = []
+        i = self.pos
+        while i < len(buf) and self.state != 'done':
+            c = buf[i]
+            state = self.state
+            if state == 'seek':
+                if c == '{':
+                    self.state = 'key'
+            elif state == 'key':
+                if c == '"':
+                    self.state, self.target, self.start = 'string', 'key', i + 1
+                elif c == '}':
+                    self.state = 'done'
+            elif state == 'colon':
+                if c == ':':
+                    self.state = 'value'
+            elif state == 'value':
+                if c == '"':
+                    self.state, self.target, self.start = 'string', 'value', i + 1
+                elif c in '{[':
+                    self.state, self.nest, self.in_string = 'nested', 1, False
+                elif not c.isspace():
+                    self.state = 'scalar'
+            elif state == 'scalar':
+                if c == ',':
+                    self.state = 'key'
+                elif c == '}':
+                    self.state = 'done'
+            elif state == 'nested':
+                if self.in_string:
+                    if c == '\\':
+                        i += 1  # skip the escaped character, even if it has not arrived yet
+                    elif c == '"':
+                        self.in_string = False
+                elif c == '"':
+                    self.in_string = True
+                elif c in '{[':
+                    self.nest += 1
+                elif c in '}]':
+                    self.nest -= 1
+                    if self.nest == 0:
+                        self.state = 'key'
+            elif state == 'string':
+                if c == '\\':
+                    i += 1
+                elif c == '"':
+                    value = json.loads('"' + buf[self.start:i] + '"', strict=False)
+                    if self.target == 'key':
+                        self.key, self.state = value, 'colon'
+                    else:
+                        fields.append((self.key, value))
+                        self.state = 'key'
+            i += 1
+        self.pos = i
+        return fields
+
+
+def stream_record(full_prompt, model_name=MODEL_NAME):
+    """Stream one prompt through the model.
+
+    Yields (key, value) for each top-level string field as soon as it is
+    complete, then (None, provocation dict) once the whole reply is in.
+    """
+    fields = FieldStream()
+    text = ''
+
+    def chunks():
+        # A generator, so the request itself is made (and timed) on the first next()
+        yield from get_model(model_name).generate_content(full_prompt, stream=True)
+
+    try:
+        for chunk in metrics.timed(chunks(), 'model_stream'):
+            text += chunk.text
+            yield from fields.feed(chunk.text)
+    except GeneratorExit:
+        raise  # the client went away
+    except Exception:
+        metrics.upstream_errors.inc()
+        raise
+    yield None, _checked_parse(text)
@@ -0,0 +1,17 @@
+# Gunicorn picks this file up automatically when started from this folder.
+# Threaded workers let a slow or streaming model call hold one thread
+# instead of a whole worker process.
+import os
+
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", "8"))
+# Streaming replies can take a while; don't kill workers mid-stream
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "120"))
+
+
+def post_worker_init(worker):
+    # Index the provocation log before this worker takes requests, rather
+    # than on whichever request happens to arrive first
+    from app import store
+    store.sync()
+    worker.log.info("Worker ready (pid: %s)", worker.pid)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Opt-in timing and counters, served in Prometheus text format at /metrics.
+
+Set METRICS_ENABLED=1 to turn it on; otherwise span() and the counters do
+nothing. Numbers are per process, so with several gunicorn workers each
+scrape sees whichever worker answered.
+"""
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "").lower() in ("1", "true", "yes")
+
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_lock = threading.Lock()
+_metrics = {}
+
+
+def _labels(labels):
+    return ','.join(f'{key}="{value}"' for key, value in labels)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def lines(self):
+        for key, value in sorted(self.values.items()):
+            yield f"{self.name}{{{_labels(key)}}} {value}" if key else f"{self.name} {value}"
+
+
+class Histogram:
+    kind = 'histogram'
+
+    def __init__(self, name, help, buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self.values = {}  # labels -> [bucket counts..., count, sum]
+
+    def observe(self, value, **labels):
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with _lock:
+            series = self.values.setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def lines(self):
+        for key, series in sorted(self.values.items()):
+            prefix = _labels(key) + ',' if key else ''
+            for bound, count in zip(self.buckets, series):
+                yield f'{self.name}_bucket{{{prefix}le="{bound}"}} {count}'
+            yield f'{self.name}_bucket{{{prefix}le="+Inf"}} {series[-2]}'
+            suffix = f"{{{_labels(key)}}}" if key else ''
+            yield f"{self.name}_count{suffix} {series[-2]}"
+            yield f"{self.name}_sum{suffix} {series[-1]:.6f}"
+
+
+def counter(name, help):
+    return _metrics.setdefault(name, Counter(name, help))
+
+
+def histogram(name, help, buckets=BUCKETS):
+    return _metrics.setdefault(name, Histogram(name, help, buckets))
+
+
+span_seconds = histogram('creative_acts_span_seconds',
+                         "Time spent in instrumented steps (file parse, store write, model call, ...)")
+request_seconds = histogram('creative_acts_request_seconds', "Time to handle an HTTP request")
+upstream_errors = counter('creative_acts_upstream_errors_total', "Model calls that raised an error")
+invalid_responses = counter('creative_acts_invalid_responses_total',
+                            "Model replies that were empty or not a valid provocation")
+generations = counter('creative_acts_generations_total', "Model calls that returned a provocation")
+
+
+@contextmanager
+def span(name):
+    """Time the block into creative_acts_span_seconds{span=name}."""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        span_seconds.observe(time.perf_counter() - start, span=name)
+
+
+def timed(iterable, name):
+    """Iterate `iterable`, timing only the waits for its items into span `name`.
+
+    Unlike a span() around the loop, time the consumer spends between items
+    (e.g. writing them to a slow client) is not counted.
+    """
+    if not METRICS_ENABLED:
+        yield from iterable
+        return
+    iterator = iter(iterable)
+    total = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                break
+            finally:
+                total += time.perf_counter() - start
+            yield item
+    finally:
+        span_seconds.observe(total, span=name)
+
+
+def render():
+    lines = []
+    with _lock:
+        for metric in _metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            lines.extend(metric.lines())
+    return '\n'.join(lines) + '\n'
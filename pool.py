@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+"""
+A pool of ready-made provocations, so "Generate" does not wait on the model.
+
+Provocations are grouped by mix: "*" for any thinker, or "<thinker slug>|*"
+for one thinker with any seed. Asking for a particular seed skips the pool
+and generates directly, so the number of mixes stays bounded by the number
+of thinkers. A background thread keeps every mix that has been asked for
+topped up: once a mix drops below the low watermark it is refilled to the
+high one. A mix nobody has popped from for `idle` seconds is dropped, and
+so is one whose thinker no longer exists, so neither keeps costing model
+calls.
+
+Each mix is a small JSON file of its own in the pool directory, with its
+own lock, so a pop only rewrites that mix's few items and pops for
+different mixes do not wait on each other. The directory is shared by all
+gunicorn workers, so the pool survives restarts, and only one worker at a
+time runs the refill thread.
+"""
+import json
+import os
+import threading
+import time
+import traceback
+from urllib.parse import quote, unquote
+
+from prompts import UnknownChoice, parse_mix
+from store import file_lock, fcntl
+
+ANY_MIX = '*'
+
+
+def pooled(mix):
+    """Whether the pool keeps `mix`: "*" or a thinker with any seed."""
+    return mix == ANY_MIX or parse_mix(mix)[1] is None
+
+
+class ProvocationPool:
+    def __init__(self, path, generate, low=2, high=5, interval=5.0, idle=86400.0,
+                 legacy_path=None):
+        # `generate(mix)` returns one new provocation dict for that mix;
+        # `path` is the pool directory and `legacy_path` an old single-file
+        # pool.json to import on start.
+        self.path = path
+        self.generate = generate
+        self.low = low
+        self.high = max(high, low)
+        self.interval = interval
+        self.idle = idle
+        self.legacy_path = legacy_path
+        self._thread = None
+        self._pid = None
+
+    def _mix_path(self, mix):
+        return os.path.join(self.path, quote(mix, safe='') + '.json')
+
+    def _lock(self, mix, exclusive=True):
+        os.makedirs(self.path, exist_ok=True)
+        return file_lock(self._mix_path(mix) + '.lock', exclusive)
+
+    def _mixes(self):
+        """Every mix with a file in the pool directory, plus "*"."""
+        try:
+            names = os.listdir(self.path)
+        except FileNotFoundError:
+            names = []
+        mixes = {unquote(name[:-len('.json')]) for name in names if name.endswith('.json')}
+        return sorted(mixes | {ANY_MIX})
+
+    def _load(self, mix):
+        """{"items": [...], "popped": time of the last pop}, or None if not pooled."""
+        try:
+            with open(self._mix_path(mix), 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {'items': [], 'popped': time.time()} if mix == ANY_MIX else None
+        except json.JSONDecodeError:
+            return {'items': [], 'popped': time.time()}
+
+    def _save(self, mix, entry):
+        mix_path = self._mix_path(mix)
+        tmp_path = mix_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(entry, f, ensure_ascii=False)
+        os.replace(tmp_path, mix_path)
+
+    def _remove(self, mix):
+        try:
+            os.remove(self._mix_path(mix))
+        except FileNotFoundError:
+            pass
+
+    def pop(self, mix=ANY_MIX):
+        """Take a ready provocation for `mix`, or None if that mix is empty.
+
+        Asking for a mix the pool has not seen before registers it, so the
+        refill thread starts keeping it stocked. Mixes that name a seed are
+        not pooled and always get None.
+        """
+        if not pooled(mix):
+            return None
+        with self._lock(mix):
+            entry = self._load(mix) or {'items': []}
+            entry['popped'] = time.time()
+            item = entry['items'].pop(0) if entry['items'] else None
+            self._save(mix, entry)
+        return item
+
+    def levels(self):
+        levels = {}
+        for mix in self._mixes():
+            entry = self._load(mix)
+            if entry is not None:  # it may have been dropped since the listing
+                levels[mix] = len(entry['items'])
+        return levels
+
+    def _push(self, mix, item):
+        with self._lock(mix):
+            entry = self._load(mix)
+            if entry is not None:  # it may have been dropped while we were generating
+                entry['items'].append(item)
+                self._save(mix, entry)
+
+    def drop(self, mix):
+        with self._lock(mix):
+            self._remove(mix)
+
+    def expire(self):
+        """Drop mixes nobody has popped from for `idle` seconds ("*" always stays)."""
+        cutoff = time.time() - self.idle
+        stale = []
+        for mix in self._mixes():
+            if mix == ANY_MIX:
+                continue
+            with self._lock(mix):
+                entry = self._load(mix)
+                if entry is not None and entry['popped'] < cutoff:
+                    self._remove(mix)
+                    stale.append(mix)
+        return stale
+
+    def import_legacy(self):
+        """Move the items of a single-file pool.json into per-mix files.
+
+        Mixes that are no longer pooled (those naming a seed) are discarded.
+        """
+        if not self.legacy_path or not os.path.exists(self.legacy_path):
+            return
+        try:
+            with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                legacy = json.load(f)
+        except json.JSONDecodeError:
+            legacy = {}
+        if not isinstance(legacy, dict):
+            legacy = {}
+        now = time.time()
+        for mix, entry in legacy.items():
+            if isinstance(entry, list):  # pool.json from before mixes expired
+                entry = {'items': entry, 'popped': now}
+            if not pooled(mix):
+                continue
+            with self._lock(mix):
+                current = self._load(mix) or {'items': [], 'popped': entry['popped']}
+                current['items'] += entry['items']
+                self._save(mix, current)
+        os.remove(self.legacy_path)
+
+    def refill_once(self):
+        """Top up every mix below the low watermark; returns how many were added.
+
+        A failing mix is logged and skipped so it cannot starve the others;
+        one whose thinker has gone from the files is dropped.
+        """
+        self.expire()
+        added = 0
+        for mix, count in self.levels().items():
+            if count >= self.low:
+                continue
+            try:
+                for _ in range(self.high - count):
+                    self._push(mix, self.generate(mix))
+                    added += 1
+            except UnknownChoice as e:
+                print(f"Dropping pool mix {mix}: {e}")
+                self.drop(mix)
+            except Exception as e:
+                print(f"Error refilling pool mix {mix}: {e}")
+                print(f"Traceback: {traceback.format_exc()}")
+        return added
+
+    def start(self):
+        """Start the refill thread in this process, if it is not running yet."""
+        # Check the pid too: a thread started before gunicorn forks does not
+        # survive into the workers.
+        if self._thread and self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._run, name='provocation-pool', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        # Only one process refills at a time: whoever holds this lock. If
+        # that worker exits the OS drops the lock and another one takes over.
+        leader = open(self.path + '.refill', 'a')
+        while fcntl:
+            try:
+                fcntl.flock(leader, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                break
+            except OSError:
+                time.sleep(self.interval)
+        try:
+            self.import_legacy()
+        except Exception as e:
+            print(f"Error importing {self.legacy_path}: {e}")
+        while True:
+            try:
+                self.refill_once()
+            except Exception as e:
+                print(f"Error refilling provocation pool: {e}")
+                print(f"Traceback: {traceback.format_exc()}")
+            time.sleep(self.interval)
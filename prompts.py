@@ -0,0 +1,193 @@
+#!/usr/bin/env python3
+"""
+Building generation prompts on the server.
+
+Thinkers and seeds are picked from weighted tables that are rebuilt only
+when thinkers.json, seeds.json, prompt.json or the sampling weights
+change. A thinker's seeds are its own "seeds" list plus the shared ones in
+seeds.json. Templates are compiled once, and finished prompts are kept
+per (thinker, seed) until the files change. Each rebuild produces one
+immutable Tables snapshot that replaces the last in a single assignment,
+so a build() running alongside a rebuild sees either the old tables or the
+new ones, never a mix.
+
+Thinkers are addressed by a slug of their name ("the-situationist"),
+seeds by "<thinker slug>/<n>" for a thinker's own seeds and "seeds/<n>"
+for the shared ones.
+"""
+import bisect
+import random
+import re
+import threading
+from collections import namedtuple
+from functools import lru_cache
+from itertools import accumulate
+
+DEFAULT_USER_PROMPT_TEMPLATE = 'GUIDING SPIRIT: {thinker_name}\n{thinker_instruction}\n\nBased on the conceptual seed "{seed}", generate a creative provocation that follows all the rules, especially the Guiding Spirit instruction.'
+
+PLACEHOLDER = re.compile(r'\{(thinker_name|thinker_instruction|seed)\}')
+SHARED_SEEDS = 'seeds'
+ANY = '*'
+
+Prompt = namedtuple('Prompt', 'text thinker seed thinker_id seed_id')
+Thinker = namedtuple('Thinker', 'id name instruction seeds')
+Seed = namedtuple('Seed', 'id text')
+# Everything build() reads, from one version of the files and weights;
+# `rendered` caches finished Prompts by (thinker id, seed id)
+Tables = namedtuple('Tables', 'version thinkers names thinker_table seed_tables '
+                              'system_prompt user_template rendered')
+
+
+class UnknownChoice(ValueError):
+    """A thinker or seed id that is not in the current files."""
+
+
+def slugify(name):
+    return re.sub(r'[^a-z0-9]+', '-', name.lower()).strip('-')
+
+
+@lru_cache(maxsize=32)
+def compile_template(template):
+    """Split a template into alternating literal text and placeholder names."""
+    return tuple(PLACEHOLDER.split(template))
+
+
+def render(compiled, values):
+    return ''.join(values[part] if i % 2 else part for i, part in enumerate(compiled))
+
+
+class WeightedTable:
+    def __init__(self, items, weights=None):
+        self.items = list(items)
+        weights = weights if weights is not None else [1.0] * len(self.items)
+        self.cumulative = list(accumulate(weights))
+
+    def pick(self, rng=random):
+        if not self.items:
+            raise UnknownChoice("Nothing to choose from")
+        total = self.cumulative[-1]
+        if total <= 0:
+            return rng.choice(self.items)
+        return self.items[bisect.bisect_right(self.cumulative, rng.random() * total)]
+
+
+def mix_key(thinker_id=None, seed_id=None):
+    """The pool mix for a selection: "*" for anything, else "<thinker>|<seed>"."""
+    if not thinker_id and not seed_id:
+        return ANY
+    return f"{thinker_id or ANY}|{seed_id or ANY}"
+
+
+def parse_mix(mix):
+    thinker_id, _, seed_id = mix.partition('|')
+    return (None if thinker_id in ('', ANY) else thinker_id,
+            None if seed_id in ('', ANY) else seed_id)
+
+
+class PromptBuilder:
+    def __init__(self, file_cache, thinkers_file, seeds_file, prompt_file, weights=None):
+        # `weights()` may return an object with weight(thinker_name) /
+        # weight(thinker_name, seed_id) and a `version` that changes with
+        # them (e.g. stats.RatingStats); by default, or when it returns None,
+        # every thinker and seed is equally likely.
+        self.file_cache = file_cache
+        self.files = (thinkers_file, seeds_file, prompt_file)
+        self.weights = weights
+        self._tables_snapshot = None
+        self._lock = threading.Lock()
+
+    def _tables(self):
+        """The current Tables, rebuilt when a source file or the weights change."""
+        entries = [self.file_cache.get(path) for path in self.files]
+        weights = self.weights() if self.weights else None
+        version = tuple(entry.etag for entry in entries) + (
+            (id(weights), weights.version) if weights else (None,))
+        tables = self._tables_snapshot
+        if tables and tables.version == version:
+            return tables
+        with self._lock:
+            tables = self._tables_snapshot
+            if tables and tables.version == version:
+                return tables
+            weigh = weights.weight if weights else (lambda *names: 1.0)
+            thinkers_data, seeds_data, prompt_data = (entry.data for entry in entries)
+            shared = [Seed(f"{SHARED_SEEDS}/{n}", text)
+                      for n, text in enumerate(seeds_data.get('seeds', []))]
+            thinkers = {}
+            for item in thinkers_data.get('thinkers', []):
+                name = item.get('name', 'Unknown')
+                thinker_id = slugify(name)
+                own = [Seed(f"{thinker_id}/{n}", text)
+                       for n, text in enumerate(item.get('seeds', []))]
+                thinkers[thinker_id] = Thinker(thinker_id, name,
+                                               item.get('spirit_instruction', ''), own + shared)
+            # Rendered prompts only depend on the files, not the weights
+            same_files = tables and tables.version[:3] == version[:3]
+            tables = Tables(
+                version=version,
+                thinkers=thinkers,
+                names={thinker.name: thinker_id for thinker_id, thinker in thinkers.items()},
+                thinker_table=WeightedTable(
+                    thinkers.values(), [weigh(thinker.name) for thinker in thinkers.values()]),
+                seed_tables={
+                    thinker_id: WeightedTable(
+                        thinker.seeds, [weigh(thinker.name, seed.id) for seed in thinker.seeds])
+                    for thinker_id, thinker in thinkers.items()
+                },
+                system_prompt=prompt_data.get('system_prompt', ''),
+                user_template=compile_template(
+                    prompt_data.get('user_prompt_template') or DEFAULT_USER_PROMPT_TEMPLATE),
+                rendered=tables.rendered if same_files else {},
+            )
+            self._tables_snapshot = tables
+            return tables
+
+    def thinker_id(self, thinker):
+        """Resolve a thinker slug or display name to its slug."""
+        return self._thinker_id(self._tables(), thinker)
+
+    def thinker(self, thinker):
+        """The Thinker for a slug or display name."""
+        tables = self._tables()
+        return tables.thinkers[self._thinker_id(tables, thinker)]
+
+    @staticmethod
+    def _thinker_id(tables, thinker):
+        if thinker in tables.thinkers:
+            return thinker
+        if thinker in tables.names:
+            return tables.names[thinker]
+        raise UnknownChoice(f"Unknown thinker: {thinker}")
+
+    def build(self, thinker=None, seed=None, rng=random):
+        """Pick (or look up) a thinker and seed and return the finished Prompt."""
+        tables = self._tables()
+        if thinker:
+            chosen = tables.thinkers[self._thinker_id(tables, thinker)]
+        elif seed and seed.split('/')[0] in tables.thinkers:
+            # A thinker's own seed implies that thinker
+            chosen = tables.thinkers[seed.split('/')[0]]
+        else:
+            chosen = tables.thinker_table.pick(rng)
+        if seed:
+            matches = [s for s in chosen.seeds if s.id == seed]
+            if not matches:
+                raise UnknownChoice(f"Unknown seed for {chosen.name}: {seed}")
+            picked = matches[0]
+        else:
+            picked = tables.seed_tables[chosen.id].pick(rng)
+        return self._render(tables, chosen, picked)
+
+    def _render(self, tables, thinker, seed):
+        key = (thinker.id, seed.id)
+        prompt = tables.rendered.get(key)
+        if prompt is None:
+            user_prompt = render(tables.user_template, {
+                'thinker_name': thinker.name,
+                'thinker_instruction': thinker.instruction,
+                'seed': seed.text,
+            })
+            prompt = Prompt(f"{tables.system_prompt}\n\n{user_prompt}",
+                            thinker.name, seed.text, thinker.id, seed.id)
+            tables.rendered[key] = prompt
+        return prompt
@@ -0,0 +1,138 @@
+#!/usr/bin/env python3
+"""
+Running rating statistics per provocation, thinker, seed and thinker/seed pair.
+
+RatingStats listens to the provocation store: every provocation and vote
+the store indexes (its own or another worker's) updates a few counters, so
+the numbers are always current and reading them never rescans history.
+For each group we keep the vote count, the sum of ratings, the number of
+positive votes and the Wilson score (a lower bound on the share of positive
+votes that stays cautious while there are only a few). Seeds are keyed by
+their id ("seeds/3", "the-dadaist/0"); provocations saved before records
+carried a seed_id count towards their thinker only.
+
+Run this file to recompute everything from the raw log:
+
+    python stats.py [provocations.jsonl]
+"""
+import json
+import math
+import sys
+import threading
+
+Z = 1.96  # 95% confidence
+
+
+def wilson(positive, count, z=Z):
+    if not count:
+        return 0.0
+    p = positive / count
+    centre = p + z * z / (2 * count)
+    spread = z * math.sqrt(p * (1 - p) / count + z * z / (4 * count * count))
+    return (centre - spread) / (1 + z * z / count)
+
+
+def _summary(counter):
+    count, total, positive = counter
+    return {
+        'count': count,
+        'sum': total,
+        'positive': positive,
+        'mean': total / count if count else None,
+        'wilson': round(wilson(positive, count), 4),
+    }
+
+
+class RatingStats:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = 0
+        self.reset()
+
+    # -- store listener ----------------------------------------------------
+
+    def reset(self):
+        with self._lock:
+            # [count, sum of ratings, positive votes]
+            self.provocations = {}
+            self.thinkers = {}
+            self.seeds = {}
+            self.pairs = {}  # (thinker, seed id) -> counter
+            self._owners = {}  # provocation id -> (thinker, seed id)
+            self.votes = 0
+            self._snapshot = None
+            self.version += 1
+
+    def on_put(self, record_id, data):
+        self._owners[record_id] = (data.get('thinker'), data.get('seed_id'))
+        for entry in data.get('feedback', []):
+            self.on_feedback(record_id, entry)
+
+    def on_feedback(self, record_id, entry):
+        rating = entry.get('rating')
+        if not isinstance(rating, (int, float)) or record_id not in self._owners:
+            return
+        thinker, seed = self._owners[record_id]
+        with self._lock:
+            groups = [(self.provocations, record_id)]
+            if thinker:
+                groups.append((self.thinkers, thinker))
+            if seed:
+                groups.append((self.seeds, seed))
+            if thinker and seed:
+                groups.append((self.pairs, (thinker, seed)))
+            for table, key in groups:
+                counter = table.setdefault(key, [0, 0, 0])
+                counter[0] += 1
+                counter[1] += rating
+                counter[2] += rating > 0
+            self.votes += 1
+            self._snapshot = None
+            self.version += 1
+
+    # -- reading -----------------------------------------------------------
+
+    def provocation(self, record_id):
+        with self._lock:
+            counter = self.provocations.get(record_id)
+            return _summary(counter) if counter else None
+
+    def snapshot(self):
+        """Totals per thinker, seed and pair; rebuilt only after something changed."""
+        with self._lock:
+            if self._snapshot is None:
+                combinations = {}
+                for (thinker, seed), c in self.pairs.items():
+                    combinations.setdefault(thinker, {})[seed] = _summary(c)
+                self._snapshot = {
+                    'votes': self.votes,
+                    'rated_provocations': len(self.provocations),
+                    'thinkers': {key: _summary(c) for key, c in self.thinkers.items()},
+                    'seeds': {key: _summary(c) for key, c in self.seeds.items()},
+                    'combinations': combinations,
+                }
+            return self._snapshot
+
+    def weight(self, thinker, seed=None):
+        """Sampling weight: the smoothed share of positive votes, 0.5 when unrated.
+
+        With a seed id this is for that seed under this thinker, not the
+        seed's votes across every thinker.
+        """
+        with self._lock:
+            counter = self.pairs.get((thinker, seed)) if seed else self.thinkers.get(thinker)
+        count, _, positive = counter or (0, 0, 0)
+        return (positive + 1) / (count + 2)
+
+
+if __name__ == '__main__':
+    import os
+    from store import ProvocationStore
+
+    path = sys.argv[1] if len(sys.argv) > 1 else 'provocations.jsonl'
+    if not os.path.exists(path):
+        sys.exit(f"No log at {path}")
+    stats = RatingStats()
+    store = ProvocationStore(path, listeners=[stats])
+    print(f"{len(store)} provocations", file=sys.stderr)
+    print(json.dumps(stats.snapshot(), indent=2, ensure_ascii=False))
@@ -0,0 +1,369 @@
+#!/usr/bin/env python3
+"""
+Append-only storage for generated provocations.
+
+The log starts with a header line naming its generation, and every change
+after that is one JSON line appended to it:
+
+    {"op": "log", "generation": "3f2a..."}
+    {"op": "put", "id": 0, "at": "...", "data": {...}}   a new provocation
+    {"op": "feedback", "id": 0, "entry": {...}}          a vote on provocation 0
+
+Each process keeps an in-memory index of where every provocation's lines
+live in the log, so adding a provocation or a vote is a single append and
+reading one is a couple of seeks. Alongside it sit the few fields pages of
+history are filtered on (thinker, creation time, ratings) and the list of
+rated ids, so a page only reads the records it returns. Writes are serialised across gunicorn
+workers with a lock file; each worker catches up on lines appended by the
+others before it reads or writes.
+
+Once feedback lines outnumber both COMPACT_EVERY and the provocations
+themselves, the log is compacted into one "put" line per provocation. The
+threshold grows with the history, so the rewrite costs O(1) per write
+averaged over many votes, but it is not free when it happens: it runs
+inline, inside the /api/vote request that crosses the threshold, and
+afterwards every other worker sees a new generation and reindexes the
+whole log on its next request.
+
+Listeners (e.g. stats.RatingStats) can follow along: they get reset() when
+indexing starts over, then on_put(id, data) and on_feedback(id, entry) for
+every line, whichever process wrote it.
+"""
+import json
+import os
+import threading
+import uuid
+from bisect import bisect_left, bisect_right, insort
+from contextlib import contextmanager
+from datetime import datetime
+
+import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: fall back to in-process locking only
+    fcntl = None
+
+COMPACT_EVERY = 500
+
+
+@contextmanager
+def file_lock(path, exclusive=True):
+    """Hold an advisory lock on `path` (created if needed) for the block."""
+    with open(path, 'a') as lock_file:
+        if fcntl:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        try:
+            yield
+        finally:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _encode(line):
+    return (json.dumps(line, ensure_ascii=False) + '\n').encode('utf-8')
+
+
+def _upgrade(record):
+    """Turn the old {"votes": {"up": n, "down": m}} counts into feedback entries."""
+    votes = record.get('votes')
+    if not isinstance(votes, dict):
+        return record
+    record = {key: value for key, value in record.items() if key != 'votes'}
+    feedback = list(record.get('feedback', []))
+    for rating, key in ((1, 'up'), (-1, 'down')):
+        count = votes.get(key)
+        if isinstance(count, int):
+            feedback += [{'rating': rating, 'comment': '', 'timestamp': None}
+                         for _ in range(count)]
+    record['feedback'] = feedback
+    return record
+
+
+class ProvocationStore:
+    def __init__(self, path, legacy_path=None, compact_every=COMPACT_EVERY, listeners=()):
+        self.path = path
+        self.lock_path = path + '.lock'
+        self.legacy_path = legacy_path
+        self.compact_every = compact_every
+        self.listeners = list(listeners)
+        self._mutex = threading.RLock()
+        self._reset()
+
+    def _reset(self):
+        # id -> [offset of the "put" line, offsets of "feedback" lines...]
+        self._index = {}
+        # id -> {'thinker', 'at', 'ratings', 'rating_sum'}, and ids in log order
+        self._meta = {}
+        self._ids = []
+        self._rated = []  # ids with at least one rating, ascending
+        self._by_thinker = {}
+        self._next_id = 0
+        self._pos = 0
+        self._generation = None
+        self._extra_lines = 0
+        for listener in self.listeners:
+            listener.reset()
+
+    # -- reading the log -------------------------------------------------
+
+    def _refresh(self):
+        """Index any lines appended since we last looked (caller holds the lock)."""
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            self._reset()
+            return
+        with f:
+            header = f.readline()
+            if not header.endswith(b'\n'):
+                return
+            generation = json.loads(header).get('generation')
+            if generation != self._generation:
+                # The log was compacted (replaced) by some process: start over.
+                self._reset()
+                self._generation = generation
+                self._pos = len(header)
+            f.seek(self._pos)
+            offset = self._pos
+            for raw in f:
+                if not raw.endswith(b'\n'):
+                    break  # torn by a writer that died mid-append; the next write cuts it off
+                self._index_line(raw, offset)
+                offset += len(raw)
+            self._pos = offset
+
+    def _index_line(self, raw, offset):
+        try:
+            line = json.loads(raw)
+        except json.JSONDecodeError:
+            return
+        record_id = line.get('id')
+        if line.get('op') == 'put':
+            data = _upgrade(line.get('data', {}))
+            if record_id in self._index:
+                self._extra_lines += 1
+                if self._meta[record_id]['ratings']:
+                    self._rated.remove(record_id)
+            else:
+                self._ids.append(record_id)
+                self._by_thinker.setdefault(data.get('thinker'), []).append(record_id)
+            self._index[record_id] = [offset]
+            self._meta[record_id] = {'thinker': data.get('thinker'), 'at': line.get('at'),
+                                     'ratings': 0, 'rating_sum': 0}
+            for entry in data.get('feedback', []):
+                self._count_rating(record_id, entry)
+            self._next_id = max(self._next_id, record_id + 1)
+            for listener in self.listeners:
+                listener.on_put(record_id, data)
+        elif line.get('op') == 'feedback' and record_id in self._index:
+            entry = line.get('entry', {})
+            self._index[record_id].append(offset)
+            self._count_rating(record_id, entry)
+            self._extra_lines += 1
+            for listener in self.listeners:
+                listener.on_feedback(record_id, entry)
+
+    def _count_rating(self, record_id, entry):
+        rating = entry.get('rating')
+        if isinstance(rating, (int, float)):
+            meta = self._meta[record_id]
+            if not meta['ratings']:
+                insort(self._rated, record_id)
+            meta['ratings'] += 1
+            meta['rating_sum'] += rating
+
+    def _write_log(self, records):
+        """Atomically replace the log with a fresh generation holding `records`."""
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_encode({'op': 'log', 'generation': uuid.uuid4().hex}))
+            for record_id, at, record in records:
+                f.write(_encode({'op': 'put', 'id': record_id, 'at': at, 'data': record}))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+
+    def _read_record(self, f, offsets):
+        f.seek(offsets[0])
+        record = dict(_upgrade(json.loads(f.readline())['data']))
+        if len(offsets) > 1:
+            feedback = list(record.get('feedback', []))
+            for offset in offsets[1:]:
+                f.seek(offset)
+                feedback.append(json.loads(f.readline())['entry'])
+            record['feedback'] = feedback
+        return record
+
+    # -- writing the log -------------------------------------------------
+
+    def _append(self, lines):
+        with metrics.span('store_write'):
+            payload = b''.join(_encode(line) for line in lines)
+            fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+            try:
+                # A writer that died mid-append leaves a line without its
+                # newline after the last one we indexed. We hold the write
+                # lock, so cut it off rather than glue our first line onto it.
+                if self._pos and os.fstat(fd).st_size > self._pos:
+                    os.ftruncate(fd, self._pos)
+                view = memoryview(payload)
+                while view:
+                    view = view[os.write(fd, view):]
+            finally:
+                os.close(fd)
+        self._refresh()
+
+    def _migrate(self):
+        """Create the log, seeded from the legacy provocations.json if there is one.
+
+        Legacy up/down vote counts become feedback entries on the way in.
+        """
+        if os.path.exists(self.path):
+            return
+        legacy = []
+        if self.legacy_path:
+            try:
+                with open(self.legacy_path, 'r', encoding='utf-8') as f:
+                    legacy = json.load(f)
+            except (FileNotFoundError, json.JSONDecodeError):
+                legacy = []
+        if not isinstance(legacy, list):
+            legacy = []
+        self._write_log((record_id, None, _upgrade(record))
+                        for record_id, record in enumerate(legacy))
+
+    @contextmanager
+    def _locked(self, exclusive):
+        with self._mutex:
+            if not os.path.exists(self.path):
+                with file_lock(self.lock_path, exclusive=True):
+                    self._migrate()
+            with file_lock(self.lock_path, exclusive):
+                self._refresh()
+                yield
+
+    # -- public API ------------------------------------------------------
+
+    def add(self, record):
+        """Append a new provocation and return its id."""
+        return self.add_many([record])[0]
+
+    def add_many(self, records):
+        """Append several provocations in one write and return their ids."""
+        with self._locked(exclusive=True):
+            # Stamped under the lock so creation times rise with ids, which
+            # page() relies on
+            at = datetime.now().isoformat()
+            ids = list(range(self._next_id, self._next_id + len(records)))
+            self._append([{'op': 'put', 'id': record_id, 'at': at, 'data': record}
+                          for record_id, record in zip(ids, records)])
+            missing = [record_id for record_id in ids if record_id not in self._index]
+        if missing:
+            raise OSError(f"provocations {missing} did not reach {self.path}")
+        return ids
+
+    def add_feedback(self, record_id, entry):
+        """Append a feedback entry; returns False if the id is unknown."""
+        with self._locked(exclusive=True):
+            if record_id not in self._index:
+                return False
+            self._append([{'op': 'feedback', 'id': record_id, 'entry': entry}])
+            if self._extra_lines >= max(self.compact_every, len(self._index)):
+                self._compact()
+        return True
+
+    def get(self, record_id):
+        with self._locked(exclusive=False):
+            offsets = self._index.get(record_id)
+            if offsets is None:
+                return None
+            with open(self.path, 'rb') as f:
+                return self._read_record(f, offsets)
+
+    def all(self):
+        """Every provocation, in id order, with feedback merged in."""
+        with self._locked(exclusive=False):
+            if not self._index:
+                return []
+            with open(self.path, 'rb') as f:
+                return [self._read_record(f, self._index[record_id])
+                        for record_id in sorted(self._index)]
+
+    def page(self, cursor=None, limit=50, thinker=None, since=None, until=None, min_rating=None):
+        """A newest-first page of provocations matching the filters.
+
+        `cursor` is the `next_cursor` of the previous page; `since`/`until`
+        are ISO timestamps compared against creation time and `min_rating`
+        against the average vote. Returns (records, next_cursor), where each
+        record carries its `id` and `created_at` and next_cursor is None on
+        the last page.
+        """
+        with self._locked(exclusive=False):
+            ids = self._by_thinker.get(thinker, []) if thinker else self._ids
+            # Only rated records can pass min_rating, so walk those instead
+            # when there are fewer of them
+            if min_rating is not None and len(self._rated) < len(ids):
+                ids = self._rated
+            end = bisect_left(ids, cursor) if cursor is not None else len(ids)
+            # Ids are handed out in time order (imported history has no time
+            # at all and comes first), so `until` is a binary search and
+            # `since` or a missing time ends the scan.
+            if until:
+                end = min(end, bisect_right(
+                    ids, until, key=lambda record_id: self._meta[record_id]['at'] or ''))
+            picked = []
+            for i in range(end - 1, -1, -1):
+                meta = self._meta[ids[i]]
+                if since and (meta['at'] or '') < since:
+                    break
+                if until and meta['at'] is None:
+                    break
+                if thinker and meta['thinker'] != thinker:
+                    continue
+                if min_rating is not None and (
+                        not meta['ratings'] or meta['rating_sum'] / meta['ratings'] < min_rating):
+                    continue
+                picked.append(ids[i])
+                if len(picked) == limit:
+                    break
+            records = []
+            if picked:
+                with open(self.path, 'rb') as f:
+                    for record_id in picked:
+                        record = self._read_record(f, self._index[record_id])
+                        record['id'] = record_id
+                        record['created_at'] = self._meta[record_id]['at']
+                        records.append(record)
+            next_cursor = picked[-1] if len(picked) == limit else None
+        return records, next_cursor
+
+    def sync(self):
+        """Catch up on lines other processes have appended."""
+        with self._locked(exclusive=False):
+            pass
+
+    def __contains__(self, record_id):
+        with self._locked(exclusive=False):
+            return record_id in self._index
+
+    def __len__(self):
+        with self._locked(exclusive=False):
+            return len(self._index)
+
+    def compact(self):
+        with self._locked(exclusive=True):
+            self._compact()
+
+    def _compact(self):
+        """Rewrite the log as one "put" line per provocation (caller holds the write lock)."""
+        if not self._index:
+            return
+        with metrics.span('store_compact'):
+            with open(self.path, 'rb') as f:
+                records = [(record_id, self._meta[record_id]['at'],
+                            self._read_record(f, self._index[record_id]))
+                           for record_id in sorted(self._index)]
+            self._write_log(records)
+        self._reset()
+        self._refresh()
@@ -0,0 +1,36 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# No background refill threads in tests; tests that need a pool make their own
+os.environ['POOL_ENABLED'] = '0'
+
+import generation  # noqa: E402
+
+DATA_FILES = ('thinkers.json', 'seeds.json', 'prompt.json', 'config.json')
+
+
+@pytest.fixture
+def app_module(tmp_path, monkeypatch):
+    """The app module, working in a scratch folder with copies of the data files."""
+    for name in DATA_FILES:
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    import app
+    return app
+
+
+@pytest.fixture
+def client(app_module):
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def fake_model(monkeypatch):
+    """Route every model call to the offline stand-in, with no delay."""
+    monkeypatch.setattr(generation, 'FAKE_MODEL', True)
+    monkeypatch.setattr(generation, 'FAKE_MODEL_LATENCY', 0.0)
@@ -0,0 +1,196 @@
+import fcntl
+import itertools
+import json
+import time
+
+import pytest
+
+from batch import BatchRun, BatchSlot, RateLimiter, RunBusy, read_run, run_status, sample_mixes
+from store import ProvocationStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return ProvocationStore(str(tmp_path / 'p.jsonl'))
+
+
+def generator(fail=()):
+    """A generate(mix) that numbers its provocations and fails on the given calls."""
+    calls = itertools.count()
+
+    def generate(mix):
+        n = next(calls)
+        if n in fail:
+            raise ValueError(f"call {n} failed")
+        return {'provocation': f'p{n}', 'mix': mix}
+    return generate
+
+
+def test_sample_mixes():
+    spec = {'thinkers': ['the-dadaist'], 'seeds': ['seeds/1', 'seeds/2']}
+    assert set(sample_mixes(20, spec)) <= {'the-dadaist|seeds/1', 'the-dadaist|seeds/2'}
+    assert sample_mixes(3, {}) == ['*', '*', '*']
+
+
+def test_run_commits_everything_in_one_write(tmp_path, store):
+    run = BatchRun(generator(), store, n=5, workers=2, rate=0, batch_dir=str(tmp_path))
+    status = run.run()
+    assert status['complete'] and status['committed'] == 5
+    assert len(store) == 5
+    ops = [line['op'] for line in map(json.loads, open(store.path))]
+    assert ops == ['log'] + ['put'] * 5
+
+
+def test_resume_generates_only_missing_items(tmp_path, store):
+    run = BatchRun(generator(fail={1, 3}), store, n=5, workers=1, rate=0,
+                   batch_dir=str(tmp_path))
+    status = run.run()
+    assert (status['done'], status['committed'], status['complete']) == (3, 3, False)
+
+    resumed = BatchRun(generator(), store, run_id=run.run_id, batch_dir=str(tmp_path))
+    assert resumed.mixes == run.mixes
+    status = resumed.run()
+    assert status['complete'] and status['committed'] == 5
+    assert len(store) == 5
+    _, records, committed, _ = read_run(run.run_id, str(tmp_path))
+    assert committed == set(range(5)) and len(records) == 5
+
+
+class CrashAfterWrite:
+    """A store whose add_many() dies after the records reach the log."""
+
+    def __init__(self, store):
+        self.store = store
+
+    def add_many(self, records):
+        self.store.add_many(records)
+        raise KeyboardInterrupt
+
+    def __getattr__(self, name):
+        return getattr(self.store, name)
+
+
+def test_resume_after_crash_mid_commit_does_not_duplicate(tmp_path, store):
+    store.add({'provocation': 'older'})
+    run = BatchRun(generator(), CrashAfterWrite(store), n=4, rate=0, batch_dir=str(tmp_path))
+    with pytest.raises(KeyboardInterrupt):
+        run.run()
+    assert run_status(run.run_id, str(tmp_path))['committed'] == 0
+
+    status = BatchRun(generator(), store, run_id=run.run_id, batch_dir=str(tmp_path)).run()
+    assert status['complete']
+    assert len(store) == 5
+    assert sorted(r['provocation'] for r in store.all()) == ['older', 'p0', 'p1', 'p2', 'p3']
+
+
+def test_retries_quota_errors(tmp_path, store):
+    attempts = []
+
+    def generate(mix):
+        attempts.append(mix)
+        if len(attempts) < 3:
+            raise RuntimeError("429 Resource has been exhausted (e.g. check quota)")
+        return {'provocation': 'finally'}
+
+    run = BatchRun(generate, store, n=1, rate=0, backoff=0, batch_dir=str(tmp_path))
+    assert run.run()['complete']
+    assert len(attempts) == 3
+
+
+def test_rate_limiter_unlimited_does_not_wait():
+    limiter = RateLimiter(0)
+    for _ in range(100):
+        limiter.wait()
+
+
+def test_a_run_is_worked_on_by_one_caller_at_a_time(tmp_path, store):
+    run = BatchRun(generator(), store, n=1, rate=0, batch_dir=str(tmp_path))
+    with open(run.path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        with pytest.raises(RunBusy):
+            run.run()
+    assert run.run()['complete']
+
+
+def wait_for_batch(client, run_id, timeout=10):
+    """Wait until the run is complete and its thread has given up the batch slot."""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        status = client.get(f'/api/generate/batch/{run_id}').get_json()
+        if status['complete']:
+            slot = BatchSlot()
+            try:
+                slot.claim()
+            except RunBusy:
+                pass
+            else:
+                slot.release()
+                return status
+        time.sleep(0.05)
+    raise AssertionError(f"batch {run_id} did not finish")
+
+
+@pytest.fixture
+def fast_batches(app_module, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_MAX_RATE', 1000.0)
+
+
+def test_batch_slot_is_exclusive(tmp_path):
+    first, second = BatchSlot(str(tmp_path)), BatchSlot(str(tmp_path))
+    first.claim()
+    with pytest.raises(RunBusy):
+        second.claim()
+    first.release()
+    second.claim()
+    second.release()
+
+
+def test_batch_routes(client, app_module, fake_model, fast_batches):
+    started = client.post('/api/generate/batch',
+                          json={'n': 3, 'thinkers': ['the-dadaist'], 'rate': 0})
+    assert started.status_code == 202
+    status = wait_for_batch(client, started.get_json()['run_id'])
+    assert status['committed'] == 3
+    assert {r['thinker'] for r in app_module.store.all()} == {'The Dadaist'}
+
+    assert client.post('/api/generate/batch', json={'n': 0}).status_code == 400
+    assert client.post('/api/generate/batch', json={'n': 1, 'thinkers': ['nobody']}).status_code == 400
+    assert client.get('/api/generate/batch/missing').status_code == 404
+
+
+@pytest.mark.parametrize('body', [{'n': 2, 'workers': 'x'}, {'n': 2, 'workers': 0},
+                                  {'n': 2, 'rate': 'fast'}, {'n': 2, 'rate': -1},
+                                  {'n': 2, 'thinkers': [['x']]}, [1]])
+def test_batch_route_rejects_bad_parameters(client, fake_model, body):
+    assert client.post('/api/generate/batch', json=body).status_code == 400
+
+
+def test_batch_items_are_distinct_even_for_one_prompt(client, app_module, fake_model,
+                                                      fast_batches, monkeypatch):
+    # Slow enough that all four workers ask for the same prompt at once
+    monkeypatch.setattr('generation.FAKE_MODEL_LATENCY', 0.1)
+    started = client.post('/api/generate/batch', json={
+        'n': 8, 'thinkers': ['the-situationist'], 'seeds': ['seeds/3'], 'workers': 4, 'rate': 0})
+    wait_for_batch(client, started.get_json()['run_id'])
+    provocations = [record['provocation'] for record in app_module.store.all()]
+    assert len(provocations) == len(set(provocations)) == 8
+
+
+def test_one_batch_at_a_time(client, fake_model, fast_batches, monkeypatch):
+    monkeypatch.setattr('generation.FAKE_MODEL_LATENCY', 0.1)
+    started = client.post('/api/generate/batch', json={'n': 2, 'workers': 1})
+    assert started.status_code == 202
+    assert client.post('/api/generate/batch', json={'n': 1}).status_code == 409
+    wait_for_batch(client, started.get_json()['run_id'])
+    again = client.post('/api/generate/batch', json={'n': 1})
+    assert again.status_code == 202
+    wait_for_batch(client, again.get_json()['run_id'])
+
+
+def test_rate_is_capped_by_the_server(client, app_module, fake_model, monkeypatch):
+    monkeypatch.setattr(app_module, 'BATCH_MAX_RATE', 10.0)
+    began = time.monotonic()
+    started = client.post('/api/generate/batch', json={'n': 3, 'rate': 0})
+    wait_for_batch(client, started.get_json()['run_id'])
+    # 0 means "as fast as allowed": three calls at 10/s take at least 0.2s
+    assert time.monotonic() - began >= 0.2
@@ -0,0 +1,81 @@
+import json
+
+from filecache import JSONFileCache
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def write(path, data):
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+def test_file_is_parsed_once_until_it_changes(tmp_path):
+    path = str(tmp_path / 'seeds.json')
+    write(path, {'seeds': ['a']})
+    calls = []
+    cache = JSONFileCache(lambda p: calls.append(p) or load(p))
+
+    first = cache.get(path)
+    assert cache.get(path) is first and len(calls) == 1
+    assert json.loads(first.body) == {'seeds': ['a']}
+
+    write(path, {'seeds': ['a', 'b']})
+    second = cache.get(path)
+    assert second.data == {'seeds': ['a', 'b']} and second.etag != first.etag
+    assert len(calls) == 2
+
+
+def test_transform_is_cached_separately(tmp_path):
+    path = str(tmp_path / 'seeds.json')
+    write(path, {'seeds': ['a', 'b']})
+    cache = JSONFileCache(load)
+    count = cache.get(path, lambda data: len(data['seeds']))
+    assert count.data == 2 and cache.get(path).data == {'seeds': ['a', 'b']}
+
+
+def test_bundle_follows_its_parts(tmp_path):
+    paths = [str(tmp_path / name) for name in ('a.json', 'b.json')]
+    for n, path in enumerate(paths):
+        write(path, [n])
+    cache = JSONFileCache(load)
+
+    def bundle():
+        return cache.bundle({'a': cache.get(paths[0]), 'b': cache.get(paths[1])})
+
+    first = bundle()
+    assert json.loads(first.body) == {'a': [0], 'b': [1]} == first.data
+    assert bundle() is first
+    write(paths[1], [1, 2])
+    assert json.loads(bundle().body) == {'a': [0], 'b': [1, 2]}
+
+
+def test_missing_file_uses_the_loader_default(tmp_path):
+    cache = JSONFileCache(lambda path: {})
+    entry = cache.get(str(tmp_path / 'missing.json'))
+    assert entry.data == {} and entry.last_modified is None
+
+
+def test_static_endpoints_answer_conditional_requests(client):
+    response = client.get('/api/seeds')
+    assert response.status_code == 200 and response.headers['ETag']
+    again = client.get('/api/seeds', headers={'If-None-Match': response.headers['ETag']})
+    assert again.status_code == 304 and again.data == b''
+
+    with open('seeds.json', encoding='utf-8') as f:
+        seeds = json.load(f)
+    seeds['seeds'].append('A brand new seed')
+    write('seeds.json', seeds)
+    changed = client.get('/api/seeds', headers={'If-None-Match': response.headers['ETag']})
+    assert changed.status_code == 200
+    assert changed.get_json()['seeds'][-1] == 'A brand new seed'
+
+
+def test_bootstrap_bundles_every_file(client):
+    bootstrap = client.get('/api/bootstrap').get_json()
+    for name in ('thinkers', 'seeds', 'prompt', 'config'):
+        assert bootstrap[name] == client.get(f'/api/{name}').get_json()
+    assert all('description' in thinker for thinker in bootstrap['thinkers'].values())
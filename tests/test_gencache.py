@@ -0,0 +1,90 @@
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gencache import GenerationCache
+
+
+def slow_producer(delay=0.1):
+    calls = itertools.count()
+    gate = threading.Lock()
+
+    def produce():
+        with gate:
+            n = next(calls)
+        time.sleep(delay)
+        return {'provocation': f'p{n}'}
+    return produce
+
+
+def test_concurrent_identical_prompts_share_one_call():
+    cache = GenerationCache(reuse=0.0)
+    produce = slow_producer()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(
+            lambda _: cache.get_or_generate('m', 'prompt', produce), range(4)))
+    assert len({r['provocation'] for r in results}) == 1
+    assert cache.stats()['misses'] == 1 and cache.stats()['coalesced'] == 3
+
+
+def test_coalesce_false_always_calls_upstream():
+    cache = GenerationCache(reuse=0.0)
+    produce = slow_producer()
+    with ThreadPoolExecutor(4) as executor:
+        results = list(executor.map(
+            lambda _: cache.get_or_generate('m', 'prompt', produce, coalesce=False), range(4)))
+    assert len({r['provocation'] for r in results}) == 4
+    assert cache.stats()['misses'] == 4 and cache.stats()['coalesced'] == 0
+
+
+def test_waiters_see_the_leaders_error():
+    cache = GenerationCache()
+    started = threading.Event()
+
+    def failing():
+        started.set()
+        time.sleep(0.1)
+        raise RuntimeError("upstream down")
+
+    with ThreadPoolExecutor(2) as executor:
+        leader = executor.submit(cache.get_or_generate, 'm', 'p', failing)
+        started.wait()
+        waiter = executor.submit(cache.get_or_generate, 'm', 'p', failing)
+        for future in (leader, waiter):
+            with pytest.raises(RuntimeError):
+                future.result()
+    assert cache.stats()['size'] == 0
+
+
+def test_reuse_and_eviction():
+    cache = GenerationCache(max_size=1, reuse=1.0)
+    produce = slow_producer(0)
+    first = cache.get_or_generate('m', 'a', produce)
+    assert cache.get_or_generate('m', 'a', produce) == first
+    cache.get_or_generate('m', 'b', produce)
+    assert cache.get_or_generate('m', 'a', produce) != first
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['evictions']) == (1, 3, 2)
+
+
+def test_reuse_zero_always_asks_again():
+    cache = GenerationCache(reuse=1.0)
+    produce = slow_producer(0)
+    first = cache.get_or_generate('m', 'a', produce)
+    assert cache.get_or_generate('m', 'a', produce, reuse=0.0) != first
+
+
+def test_entries_expire():
+    cache = GenerationCache(ttl=0.0, reuse=1.0)
+    produce = slow_producer(0)
+    first = cache.get_or_generate('m', 'a', produce)
+    time.sleep(0.01)
+    assert cache.get_or_generate('m', 'a', produce) != first
+
+
+def test_cache_stats_route(client):
+    stats = client.get('/api/generate/cache').get_json()
+    assert {'hits', 'misses', 'coalesced', 'size', 'reuse'} <= set(stats)
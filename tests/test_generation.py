@@ -0,0 +1,85 @@
+import json
+
+import pytest
+
+from generation import FieldStream, GenerationError, parse_record, stream_record
+
+RECORD = {
+    'provocation': 'Say "hello" to a\\b wall é—\nthen leave',
+    'meta': {'nested': ['x', '"}]'], 'n': 1},
+    'score': 3,
+    'task': 'Tab\there, quote \\" and slash \\/',
+}
+TEXT = '```json\n' + json.dumps(RECORD, indent=2) + '\n```'
+ESCAPED = '```json\n' + json.dumps(RECORD, indent=2, ensure_ascii=False) + '\n```'
+STRINGS = [(key, value) for key, value in RECORD.items() if isinstance(value, str)]
+
+
+def feed_all(chunks):
+    stream = FieldStream()
+    fields = []
+    for chunk in chunks:
+        fields.extend(stream.feed(chunk))
+    return fields
+
+
+@pytest.mark.parametrize('text', [TEXT, ESCAPED])
+def test_field_stream_whole_text(text):
+    assert feed_all([text]) == STRINGS
+
+
+@pytest.mark.parametrize('text', [TEXT, ESCAPED])
+def test_field_stream_every_split_point(text):
+    # Includes splits right after a backslash and inside \uXXXX escapes
+    for split in range(1, len(text)):
+        assert feed_all([text[:split], text[split:]]) == STRINGS, split
+
+
+def test_field_stream_one_character_at_a_time():
+    assert feed_all(TEXT) == STRINGS
+
+
+def test_field_stream_reports_fields_as_soon_as_complete():
+    stream = FieldStream()
+    assert stream.feed('{"provocation": "Half') == []
+    assert stream.feed(' done", "task": "') == [('provocation', 'Half done')]
+    assert stream.feed('x"}') == [('task', 'x')]
+
+
+def test_parse_record():
+    assert parse_record(TEXT) == RECORD
+    with pytest.raises(GenerationError):
+        parse_record('not json')
+    with pytest.raises(GenerationError):
+        parse_record('{"task": "no provocation"}')
+
+
+def test_stream_record_with_fake_model(fake_model):
+    events = list(stream_record('prompt'))
+    fields, (last_key, record) = events[:-1], events[-1]
+    assert last_key is None
+    assert fields == [('provocation', record['provocation']), ('task', record['task'])]
+
+
+def sse_events(body):
+    events = []
+    for block in body.decode('utf-8').strip().split('\n\n'):
+        lines = dict(line.split(': ', 1) for line in block.split('\n'))
+        events.append((lines['event'], json.loads(lines['data'])))
+    return events
+
+
+def test_stream_route_sends_fields_then_the_saved_record(client, app_module, fake_model):
+    response = client.get('/api/generate/stream?thinker=the-dadaist')
+    assert response.mimetype == 'text/event-stream'
+    events = sse_events(response.data)
+    assert [name for name, _ in events] == ['provocation', 'task', 'done']
+    done = events[-1][1]
+    assert events[0][1] == {'provocation': done['provocation']}
+    assert done['thinker'] == 'The Dadaist'
+    saved = dict(done)
+    assert app_module.store.get(saved.pop('id')) == saved
+
+
+def test_stream_route_rejects_unknown_ids(client, fake_model):
+    assert client.get('/api/generate/stream?seed=seeds/999').status_code == 400
@@ -0,0 +1,88 @@
+import importlib
+import time
+
+import pytest
+
+import metrics
+from generation import generate_record
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+
+
+def test_disabled_metrics_record_nothing():
+    counter = metrics.Counter('c', 'help')
+    counter.inc()
+    with metrics.span('nothing'):
+        pass
+    assert counter.values == {}
+
+
+def test_counter_lines(enabled):
+    counter = metrics.Counter('requests_total', 'help')
+    counter.inc()
+    counter.inc(2, endpoint='vote')
+    assert list(counter.lines()) == ['requests_total 1', 'requests_total{endpoint="vote"} 2']
+
+
+def test_histogram_lines(enabled):
+    histogram = metrics.Histogram('latency_seconds', 'help', buckets=(0.1, 1))
+    histogram.observe(0.05)
+    histogram.observe(0.5)
+    histogram.observe(5)
+    assert list(histogram.lines()) == [
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        'latency_seconds_count 3',
+        'latency_seconds_sum 5.550000',
+    ]
+
+
+def test_spans_and_model_counters_are_rendered(enabled, fake_model):
+    generate_record('prompt')
+    text = metrics.render()
+    assert '# TYPE creative_acts_span_seconds histogram' in text
+    assert 'creative_acts_span_seconds_count{span="model_call"}' in text
+    assert 'creative_acts_generations_total ' in text
+
+
+def test_metrics_route(client, monkeypatch):
+    assert client.get('/metrics').status_code == 404
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    response = client.get('/metrics')
+    assert response.status_code == 200 and response.mimetype == 'text/plain'
+    assert '# HELP creative_acts_request_seconds' in response.get_data(as_text=True)
+
+
+def test_timed_counts_only_the_waits_for_items(enabled):
+    def slow():
+        time.sleep(0.05)
+        yield 1
+
+    before = metrics.span_seconds.values.get((('span', 'timed_test'),), [0] * 17)[-1]
+    for _ in metrics.timed(slow(), 'timed_test'):
+        time.sleep(0.2)  # the consumer's own time
+    spent = metrics.span_seconds.values[(('span', 'timed_test'),)][-1] - before
+    assert 0.05 <= spent < 0.2
+
+
+@pytest.fixture
+def metered_app(app_module, monkeypatch):
+    # The request hooks are only registered when metrics are on at import
+    monkeypatch.setattr(metrics, 'METRICS_ENABLED', True)
+    yield importlib.reload(app_module)
+    monkeypatch.undo()
+    importlib.reload(app_module)
+
+
+def test_streamed_requests_are_timed_to_their_last_byte(metered_app, fake_model, monkeypatch):
+    monkeypatch.setattr('generation.FAKE_MODEL_LATENCY', 0.3)  # spread over the chunks
+    key = (('endpoint', 'stream_provocation'), ('method', 'GET'), ('status', 200))
+    before = metrics.request_seconds.values.get(key, [0] * 17)[-1]
+    response = metered_app.app.test_client().get('/api/generate/stream')
+    assert 'event: done' in response.get_data(as_text=True)
+    response.close()
+    assert metrics.request_seconds.values[key][-1] - before >= 0.25
@@ -0,0 +1,128 @@
+import json
+import time
+
+import pytest
+
+from generation import FakeModel, extract_json, generate_record
+from pool import ANY_MIX, ProvocationPool
+
+
+@pytest.fixture
+def pool(tmp_path, app_module, fake_model):
+    # The app's own refill function, answered by the offline stand-in
+    return ProvocationPool(str(tmp_path / 'pool'), app_module.refill_mix,
+                           low=2, high=4)
+
+
+def test_fake_model_answers_like_gemini():
+    text = FakeModel(latency=0).generate_content('prompt').text
+    assert text.startswith('```json')
+    assert set(extract_json(text)) == {'provocation', 'task'}
+
+
+def test_generate_record_with_fake_model(fake_model):
+    record = generate_record('any prompt')
+    assert record['provocation'] and record['task']
+
+
+def test_refill_tops_up_every_asked_for_mix(pool):
+    assert pool.pop(ANY_MIX) is None
+    assert pool.pop('the-dadaist|*') is None  # registers the mix
+    assert pool.refill_once() == 8
+    assert pool.levels() == {ANY_MIX: 4, 'the-dadaist|*': 4}
+
+    item = pool.pop('the-dadaist|*')
+    assert item['thinker'] == 'The Dadaist' and item['provocation'] and item['seed']
+    assert pool.refill_once() == 0  # still at or above the low watermark
+    pool.pop('the-dadaist|*')
+    pool.pop('the-dadaist|*')
+    assert pool.refill_once() == 3
+
+
+def test_pool_file_is_shared_between_instances(pool):
+    other = ProvocationPool(pool.path, pool.generate, low=2, high=4)
+    pool.refill_once()
+    assert other.pop() is not None
+    assert pool.levels()[ANY_MIX] == 3
+
+
+def test_generate_serves_from_the_pool(client, app_module, pool, monkeypatch):
+    monkeypatch.setattr(app_module, 'POOL_ENABLED', True)
+    monkeypatch.setattr(app_module, 'pool', pool)
+    monkeypatch.setattr(pool, 'start', lambda: None)
+    pool.pop('the-dadaist|*')
+    pool.refill_once()
+    ready = ProvocationPool(pool.path, None)._load('the-dadaist|*')['items'][0]
+
+    result = client.post('/api/generate', json={'thinker': 'the-dadaist'}).get_json()
+    assert app_module.store.get(result.pop('id')) == ready == result
+    assert pool.levels()['the-dadaist|*'] == 3
+
+
+def test_generate_without_pool(client, fake_model):
+    result = client.post('/api/generate', json={}).get_json()
+    assert result['provocation'] and result['thinker']
+    assert client.post('/api/generate', json={'thinker': 'nobody'}).status_code == 400
+
+
+def test_unknown_mix_is_dropped_without_starving_the_rest(pool):
+    pool.pop('the-removed|*')
+    pool.pop('the-dadaist|*')
+    assert pool.refill_once() == 8
+    assert pool.levels() == {ANY_MIX: 4, 'the-dadaist|*': 4}
+
+
+def test_other_errors_skip_only_that_mix(tmp_path):
+    def generate(mix):
+        if mix == 'broken|*':
+            raise RuntimeError("upstream down")
+        return {'provocation': mix}
+
+    pool = ProvocationPool(str(tmp_path / 'pool'), generate, low=1, high=2)
+    pool.pop('broken|*')
+    pool.pop('fine|*')
+    assert pool.refill_once() == 4
+    assert pool.levels() == {ANY_MIX: 2, 'broken|*': 0, 'fine|*': 2}
+
+
+def test_idle_mixes_expire(tmp_path):
+    pool = ProvocationPool(str(tmp_path / 'pool'), lambda mix: {'provocation': mix},
+                           idle=60)
+    pool.pop(ANY_MIX)
+    pool.pop('old|*')
+    for mix in (ANY_MIX, 'old|*'):
+        entry = pool._load(mix)
+        entry['popped'] = time.time() - 120
+        pool._save(mix, entry)
+    pool.pop('new|*')
+    assert pool.expire() == ['old|*']
+    assert set(pool.levels()) == {ANY_MIX, 'new|*'}
+
+
+def test_seed_mixes_are_not_pooled(pool):
+    assert pool.pop('the-dadaist|seeds/3') is None
+    assert pool.pop('*|seeds/3') is None
+    assert pool.levels() == {ANY_MIX: 0}
+
+
+def test_generate_with_a_seed_skips_the_pool(client, app_module, pool, monkeypatch):
+    monkeypatch.setattr(app_module, 'POOL_ENABLED', True)
+    monkeypatch.setattr(app_module, 'pool', pool)
+    monkeypatch.setattr(pool, 'start', lambda: None)
+    result = client.post('/api/generate', json={'thinker': 'the-dadaist',
+                                                'seed': 'seeds/3'}).get_json()
+    assert result['seed_id'] == 'seeds/3'
+    assert pool.levels() == {ANY_MIX: 0}
+
+
+def test_legacy_pool_file_is_imported(tmp_path):
+    legacy = tmp_path / 'pool.json'
+    legacy.write_text(json.dumps({ANY_MIX: [{'provocation': 'a'}],
+                                  'the-dadaist|*': {'items': [{'provocation': 'b'}],
+                                                    'popped': time.time()},
+                                  'the-dadaist|seeds/3': [{'provocation': 'c'}]}))
+    pool = ProvocationPool(str(tmp_path / 'pool'), None, legacy_path=str(legacy))
+    pool.import_legacy()
+    assert not legacy.exists()
+    assert pool.levels() == {ANY_MIX: 1, 'the-dadaist|*': 1}
+    assert pool.pop('the-dadaist|*') == {'provocation': 'b'}
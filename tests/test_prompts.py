@@ -0,0 +1,131 @@
+import json
+import os
+import random
+import shutil
+
+import pytest
+
+from conftest import ROOT
+from filecache import JSONFileCache
+from prompts import (PromptBuilder, UnknownChoice, WeightedTable, compile_template,
+                     mix_key, parse_mix, render)
+
+
+def load(path):
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+@pytest.fixture
+def files(tmp_path):
+    paths = []
+    for name in ('thinkers.json', 'seeds.json', 'prompt.json'):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+        paths.append(str(tmp_path / name))
+    return paths
+
+
+def builder(files, **kwargs):
+    return PromptBuilder(JSONFileCache(load), *files, **kwargs)
+
+
+def test_compile_template_and_render():
+    compiled = compile_template('{thinker_name} says {seed} {unknown}')
+    assert compiled is compile_template('{thinker_name} says {seed} {unknown}')
+    assert render(compiled, {'thinker_name': 'A', 'seed': 'B'}) == 'A says B {unknown}'
+
+
+def test_weighted_table():
+    rng = random.Random(1)
+    assert {WeightedTable('abc', [0, 1, 0]).pick(rng) for _ in range(50)} == {'b'}
+    assert {WeightedTable('ab', [0, 0]).pick(rng) for _ in range(50)} == {'a', 'b'}
+    with pytest.raises(UnknownChoice):
+        WeightedTable([]).pick()
+
+
+def test_mix_keys():
+    assert mix_key() == '*' and parse_mix('*') == (None, None)
+    assert mix_key('the-dadaist') == 'the-dadaist|*'
+    assert parse_mix(mix_key(None, 'seeds/3')) == (None, 'seeds/3')
+    assert parse_mix(mix_key('the-dadaist', 'the-dadaist/0')) == ('the-dadaist', 'the-dadaist/0')
+
+
+def test_build_looks_up_thinkers_and_seeds(files):
+    prompts = builder(files)
+    thinker = load(files[0])['thinkers'][1]
+    by_slug = prompts.build('the-dadaist', 'seeds/0')
+    assert by_slug is prompts.build('The Dadaist', 'seeds/0')  # rendered once
+    assert by_slug.thinker == thinker['name'] == 'The Dadaist'
+    assert by_slug.seed == load(files[1])['seeds'][0]
+    assert thinker['spirit_instruction'] in by_slug.text and by_slug.seed in by_slug.text
+    assert prompts.thinker('the-dadaist') is prompts.thinker('The Dadaist')
+
+
+def test_own_seed_implies_its_thinker(files):
+    prompt = builder(files).build(seed='the-dadaist/2')
+    assert (prompt.thinker_id, prompt.seed) == ('the-dadaist', load(files[0])['thinkers'][1]['seeds'][2])
+
+
+def test_unknown_ids(files):
+    prompts = builder(files)
+    with pytest.raises(UnknownChoice):
+        prompts.build('nobody')
+    with pytest.raises(UnknownChoice):
+        prompts.build(seed='seeds/999')
+    with pytest.raises(UnknownChoice):
+        prompts.build('the-dadaist', 'the-situationist/0')  # another thinker's own seed
+
+
+def test_tables_follow_file_edits(files):
+    prompts = builder(files)
+    prompts.build()
+    data = load(files[0])
+    data['thinkers'].append({'name': 'The Newcomer', 'spirit_instruction': 'Arrive.',
+                             'seeds': ['A door']})
+    with open(files[0], 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+    assert prompts.build('the-newcomer', 'the-newcomer/0').seed == 'A door'
+
+
+class OnlyTheOracle:
+    version = 1
+
+    def weight(self, thinker, seed=None):
+        return 1.0 if thinker == 'The Oracle' else 0.0
+
+
+def test_weights_steer_sampling(files):
+    weights = OnlyTheOracle()
+    prompts = builder(files, weights=lambda: weights)
+    rng = random.Random(0)
+    assert {prompts.build(rng=rng).thinker_id for _ in range(30)} == {'the-oracle'}
+    weights.weight = lambda thinker, seed=None: 1.0 if thinker == 'The Dadaist' else 0.0
+    weights.version = 2  # tables are rebuilt when the version changes
+    assert {prompts.build(rng=rng).thinker_id for _ in range(30)} == {'the-dadaist'}
+
+
+def test_rebuilds_swap_in_a_new_snapshot(files):
+    weights = OnlyTheOracle()
+    prompts = builder(files, weights=lambda: weights)
+    before = prompts._tables()
+    prompt = prompts.build('the-oracle', 'seeds/1')
+    weights.version = 2
+    after = prompts._tables()
+    # The old snapshot is left as it was for builds still using it; rendered
+    # prompts carry over because only the weights changed
+    assert after is not before and after.thinker_table is not before.thinker_table
+    assert before.version[-1] == 1 and after.version[-1] == 2
+    assert prompts.build('the-oracle', 'seeds/1') is prompt
+
+
+def test_generate_route_checks_ids(client, fake_model):
+    result = client.post('/api/generate', json={'seed': 'the-dadaist/0'}).get_json()
+    assert result['thinker'] == 'The Dadaist'
+    assert client.post('/api/generate', json={'thinker': 'nobody'}).status_code == 400
+    assert client.post('/api/generate', json={'seed': 'seeds/999'}).status_code == 400
+
+
+@pytest.mark.parametrize('body', [{'seed': 5}, {'thinker': ['the-dadaist']}, [1, 2]])
+def test_generate_route_rejects_malformed_ids(client, fake_model, body):
+    response = client.post('/api/generate', json=body)
+    assert response.status_code == 400 and 'detail' not in response.get_json()
@@ -0,0 +1,65 @@
+import gzip
+import json
+
+import pytest
+
+
+@pytest.fixture
+def history(app_module):
+    store = app_module.store
+    for i in range(7):
+        thinker = 'The Dadaist' if i % 2 else 'The Oracle'
+        store.add({'provocation': f'p{i}', 'task': 't', 'thinker': thinker})
+    store.add_feedback(3, {'rating': 1})
+    store.add_feedback(5, {'rating': -1})
+    return store
+
+
+def test_pages_walk_the_history_newest_first(client, history):
+    seen, query = [], {'limit': 3}
+    while True:
+        page = client.get('/api/provocations', query_string=query).get_json()
+        seen += [record['id'] for record in page['items']]
+        if page['next_cursor'] is None:
+            break
+        query['cursor'] = page['next_cursor']
+    assert seen == [6, 5, 4, 3, 2, 1, 0]
+
+
+def test_filters_and_fields(client, history):
+    page = client.get('/api/provocations?thinker=the-dadaist&fields=provocation').get_json()
+    assert page['items'] == [{'id': 5, 'provocation': 'p5'}, {'id': 3, 'provocation': 'p3'},
+                             {'id': 1, 'provocation': 'p1'}]
+    page = client.get('/api/provocations?min_rating=0.5').get_json()
+    assert [record['id'] for record in page['items']] == [3]
+    assert page['items'][0]['created_at']
+
+
+def test_gzip_when_accepted(client, history):
+    response = client.get('/api/provocations', headers={'Accept-Encoding': 'gzip'})
+    assert response.headers['Content-Encoding'] == 'gzip'
+    assert 'Accept-Encoding' in response.headers['Vary']
+    body = json.loads(gzip.decompress(response.data))
+    assert len(body['items']) == 7 and body['next_cursor'] is None
+
+
+@pytest.mark.parametrize('query', ['limit=x', 'min_rating=high', 'since=yesterday',
+                                   'until=2025-13-01', 'cursor=abc'])
+def test_malformed_query_is_a_400(client, query):
+    response = client.get(f'/api/provocations?{query}')
+    assert response.status_code == 400 and 'error' in response.get_json()
+
+
+def test_vote_by_returned_id(client, app_module, fake_model):
+    record = client.post('/api/generate', json={}).get_json()
+    response = client.post('/api/vote', json={'id': record['id'], 'vote': 1})
+    assert response.get_json() == {'success': True}
+    assert app_module.store.get(record['id'])['feedback'][0]['rating'] == 1
+
+
+@pytest.mark.parametrize('body', [[1], {'id': True, 'vote': 1}, {'id': 0, 'vote': True},
+                                  {'id': 0, 'vote': 5}, {'id': 0, 'vote': 'up'},
+                                  {'id': 0, 'vote': 1.5}, {'id': '0', 'vote': 1}])
+def test_vote_rejects_malformed_bodies(client, history, body):
+    assert client.post('/api/vote', json=body).status_code == 400
+    assert history.get(0).get('feedback') is None
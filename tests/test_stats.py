@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from stats import RatingStats, wilson
+from store import ProvocationStore
+
+
+def test_wilson():
+    assert wilson(0, 0) == 0.0
+    assert wilson(1, 1) == pytest.approx(0.2065, abs=1e-4)
+    assert wilson(90, 100) > wilson(9, 10) > wilson(1, 1)
+
+
+@pytest.fixture
+def rated(tmp_path):
+    stats = RatingStats()
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'), compact_every=3, listeners=[stats])
+    store.add({'provocation': 'a', 'thinker': 'A', 'seed_id': 'seeds/1'})
+    store.add({'provocation': 'b', 'thinker': 'A', 'seed_id': 'seeds/2'})
+    store.add({'provocation': 'c', 'thinker': 'B', 'seed_id': 'seeds/1'})
+    for record_id, rating in ((0, 1), (0, 1), (1, -1), (2, 1)):
+        store.add_feedback(record_id, {'rating': rating})
+    return store, stats
+
+
+def test_counters_follow_the_store(rated):
+    _, stats = rated
+    snapshot = stats.snapshot()
+    assert snapshot['votes'] == 4 and snapshot['rated_provocations'] == 3
+    assert snapshot['thinkers']['A'] == {'count': 3, 'sum': 1, 'positive': 2,
+                                         'mean': 1 / 3, 'wilson': round(wilson(2, 3), 4)}
+    assert snapshot['seeds']['seeds/1']['count'] == 3
+    assert snapshot['combinations']['A']['seeds/1']['count'] == 2
+    assert snapshot['combinations']['B']['seeds/1']['count'] == 1
+    assert stats.provocation(0)['sum'] == 2 and stats.provocation(9) is None
+
+
+def test_counters_survive_compaction_and_other_writers(rated, tmp_path):
+    store, stats = rated
+    before = stats.snapshot()
+    store.compact()
+    assert stats.snapshot() == before
+
+    other = ProvocationStore(store.path)  # another worker
+    other.add_feedback(2, {'rating': -1})
+    store.sync()
+    assert stats.snapshot()['thinkers']['B']['count'] == 2
+
+
+def test_weight_and_version(rated):
+    store, stats = rated
+    assert stats.weight('A') == pytest.approx(3 / 5)
+    assert stats.weight('nobody') == 0.5
+    # A seed is weighted by its votes under that thinker only
+    assert stats.weight('A', 'seeds/1') == pytest.approx(3 / 4)
+    assert stats.weight('B', 'seeds/1') == pytest.approx(2 / 3)
+    assert stats.weight('B', 'seeds/2') == 0.5
+    version = stats.version
+    store.add_feedback(1, {'rating': 1})
+    assert stats.version > version
+
+
+def test_non_numeric_ratings_are_ignored(rated):
+    store, stats = rated
+    store.add_feedback(0, {'rating': 'great'})
+    assert stats.snapshot()['votes'] == 4
+
+
+def test_stats_route(client, app_module):
+    record_id = app_module.store.add({'provocation': 'x', 'thinker': 'The Oracle',
+                                      'seed_id': 'seeds/0'})
+    assert client.get(f'/api/stats?id={record_id}').status_code == 404
+    client.post('/api/vote', json={'id': record_id, 'vote': 1})
+    assert client.get(f'/api/stats?id={record_id}').get_json()['positive'] == 1
+    stats = client.get('/api/stats').get_json()
+    assert stats['thinkers']['The Oracle']['count'] == 1
+    assert stats['combinations']['The Oracle']['seeds/0']['positive'] == 1
+
+
+@pytest.mark.parametrize('query', ['id=abc', 'id=', 'id=1.5'])
+def test_stats_route_rejects_malformed_ids(client, query):
+    response = client.get(f'/api/stats?{query}')
+    assert response.status_code == 400 and 'error' in response.get_json()
+
+
+def test_feedback_weighting_is_opt_in(app_module):
+    assert app_module.sampling_weights() is None
+    with open('config.json', encoding='utf-8') as f:
+        config = json.load(f)
+    config['feedback_weighting'] = True
+    with open('config.json', 'w', encoding='utf-8') as f:
+        json.dump(config, f)
+    assert app_module.sampling_weights() is app_module.rating_stats
+
+
+def test_generated_records_carry_the_seed_id(client, app_module, fake_model):
+    record = client.post('/api/generate', json={'seed': 'seeds/3'}).get_json()
+    assert app_module.store.get(record['id'])['seed_id'] == 'seeds/3'
@@ -0,0 +1,180 @@
+import json
+import multiprocessing
+import os
+import time
+
+import pytest
+
+from store import ProvocationStore
+
+
+def log_lines(path):
+    with open(path, encoding='utf-8') as f:
+        return [json.loads(line) for line in f]
+
+
+def vote(rating):
+    return {'rating': rating, 'comment': '', 'timestamp': '2025-01-01T00:00:00'}
+
+
+def test_add_and_get(tmp_path):
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'))
+    assert store.add({'provocation': 'a'}) == 0
+    assert store.add_many([{'provocation': 'b'}, {'provocation': 'c'}]) == [1, 2]
+    assert store.add_feedback(1, vote(1))
+    assert not store.add_feedback(7, vote(1))
+    assert store.get(1) == {'provocation': 'b', 'feedback': [vote(1)]}
+    assert [record['provocation'] for record in store.all()] == ['a', 'b', 'c']
+    assert len(store) == 3 and 2 in store and 3 not in store
+
+
+def test_legacy_import(tmp_path):
+    legacy = tmp_path / 'provocations.json'
+    legacy.write_text(json.dumps([{'provocation': 'old', 'feedback': [vote(-1)]}]))
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'), legacy_path=str(legacy))
+    assert store.get(0) == {'provocation': 'old', 'feedback': [vote(-1)]}
+    assert store.add({'provocation': 'new'}) == 1
+    assert log_lines(tmp_path / 'p.jsonl')[0]['op'] == 'log'
+
+
+def test_torn_tail_is_cut_off_before_the_next_append(tmp_path):
+    path = tmp_path / 'p.jsonl'
+    store = ProvocationStore(str(path))
+    store.add({'provocation': 'a'})
+    with open(path, 'ab') as f:
+        f.write(b'{"op": "put", "id": 1, "da')  # a writer died here
+    assert ProvocationStore(str(path)).add({'provocation': 'b'}) == 1
+    assert [line['op'] for line in log_lines(path)] == ['log', 'put', 'put']
+    assert store.get(1) == {'provocation': 'b'}
+
+
+def test_short_writes_are_resumed(tmp_path, monkeypatch):
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'))
+    len(store)  # creates the log
+    write = os.write
+    monkeypatch.setattr(os, 'write', lambda fd, data: write(fd, data[:5]))
+    assert store.add_many([{'provocation': 'a'}, {'provocation': 'b'}]) == [0, 1]
+    assert store.get(1) == {'provocation': 'b'}
+
+
+def test_add_many_fails_if_records_were_not_indexed(tmp_path, monkeypatch):
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'))
+    monkeypatch.setattr(store, '_append', lambda lines: None)
+    with pytest.raises(OSError):
+        store.add({'provocation': 'lost'})
+
+
+def test_legacy_vote_counts_become_feedback(tmp_path):
+    legacy = tmp_path / 'provocations.json'
+    legacy.write_text(json.dumps([{'provocation': 'up', 'votes': {'up': 2, 'down': 0}},
+                                  {'provocation': 'down', 'votes': {'up': 0, 'down': 1}}]))
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'), legacy_path=str(legacy))
+    assert [entry['rating'] for entry in store.get(0)['feedback']] == [1, 1]
+    assert 'votes' not in store.get(1)
+    assert [r['id'] for r in store.page(min_rating=0)[0]] == [0]
+
+    # Logs written before the conversion are read the same way
+    path = tmp_path / 'old.jsonl'
+    path.write_text(json.dumps({'op': 'log', 'generation': 'g'}) + '\n' + json.dumps(
+        {'op': 'put', 'id': 0, 'at': None, 'data': {'votes': {'up': 0, 'down': 1}}}) + '\n')
+    old = ProvocationStore(str(path))
+    assert old.get(0)['feedback'][0]['rating'] == -1
+    assert [r['id'] for r in old.page(min_rating=-1)[0]] == [0]
+
+
+def test_min_rating_walks_rated_ids(tmp_path):
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'))
+    store.add_many([{'provocation': str(i), 'thinker': 'A' if i % 2 else 'B'}
+                    for i in range(10)])
+    for record_id, rating in ((7, 1), (2, 1), (5, -1), (7, -1)):
+        store.add_feedback(record_id, vote(rating))
+    assert store._rated == [2, 5, 7]
+    assert [r['id'] for r in store.page(min_rating=0)[0]] == [7, 2]
+    assert [r['id'] for r in store.page(min_rating=-1, thinker='A')[0]] == [7, 5]
+    records, cursor = store.page(min_rating=-1, limit=2)
+    assert [r['id'] for r in records] == [7, 5] and cursor == 5
+    assert [r['id'] for r in store.page(cursor, min_rating=-1)[0]] == [2]
+
+
+def test_compaction_keeps_records_and_other_instances_reindex(tmp_path):
+    path = str(tmp_path / 'p.jsonl')
+    writer = ProvocationStore(path, compact_every=4)
+    reader = ProvocationStore(path)  # stands in for another worker
+    writer.add_many([{'provocation': 'a'}, {'provocation': 'b'}])
+    assert len(reader) == 2
+    generation = log_lines(path)[0]['generation']
+
+    for rating in (1, -1, 1, 1):
+        writer.add_feedback(0, vote(rating))
+
+    lines = log_lines(path)
+    assert lines[0]['generation'] != generation
+    assert [line['op'] for line in lines] == ['log', 'put', 'put']
+    assert len(reader.get(0)['feedback']) == 4
+    # Both instances keep appending to the new generation
+    reader.add_feedback(1, vote(1))
+    assert writer.get(1)['feedback'] == [vote(1)]
+    assert writer.add({'provocation': 'c'}) == 2
+
+
+def test_compaction_waits_for_history_to_be_outnumbered(tmp_path):
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'), compact_every=2)
+    store.add_many([{'provocation': str(i)} for i in range(5)])
+    for _ in range(4):
+        store.add_feedback(0, vote(1))
+    assert len(log_lines(tmp_path / 'p.jsonl')) == 1 + 5 + 4
+    store.add_feedback(0, vote(1))
+    assert len(log_lines(tmp_path / 'p.jsonl')) == 1 + 5
+
+
+def _worker(path, n):
+    store = ProvocationStore(path, compact_every=10)
+    for i in range(n):
+        record_id = store.add({'provocation': f'{i}'})
+        # Three votes per record keeps feedback ahead of the history, so the
+        # log is compacted repeatedly while the other processes write
+        for _ in range(3):
+            store.add_feedback(record_id, vote(1))
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(),
+                    reason="needs fork")
+def test_concurrent_processes_lose_nothing(tmp_path):
+    path = str(tmp_path / 'p.jsonl')
+    assert len(ProvocationStore(path)) == 0  # creates the log
+    context = multiprocessing.get_context('fork')
+    workers = [context.Process(target=_worker, args=(path, 25)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+        assert worker.exitcode == 0
+
+    records = ProvocationStore(path).all()
+    assert len(records) == 100
+    assert all(record['feedback'] == [vote(1)] * 3 for record in records)
+    assert len(log_lines(path)) < 1 + 100 * 4  # compacted at least once
+
+
+def test_page_filters_and_cursor(tmp_path):
+    legacy = tmp_path / 'provocations.json'
+    legacy.write_text(json.dumps([{'provocation': 'old'}]))
+    store = ProvocationStore(str(tmp_path / 'p.jsonl'), legacy_path=str(legacy))
+    for i in range(5):
+        store.add({'provocation': str(i), 'thinker': 'A' if i % 2 else 'B'})
+        time.sleep(0.001)  # distinct creation times
+    store.add_feedback(2, vote(1))
+
+    records, cursor = store.page(limit=2)
+    assert [record['id'] for record in records] == [5, 4] and cursor == 4
+    records, cursor = store.page(cursor, limit=10)
+    assert [record['id'] for record in records] == [3, 2, 1, 0] and cursor is None
+
+    assert [r['id'] for r in store.page(thinker='A')[0]] == [4, 2]
+    assert [r['id'] for r in store.page(min_rating=1)[0]] == [2]
+
+    created = {r['id']: r['created_at'] for r in store.page()[0]}
+    assert created[0] is None
+    assert [r['id'] for r in store.page(until=created[3])[0]] == [3, 2, 1]
+    assert [r['id'] for r in store.page(since=created[4])[0]] == [5, 4]
+    assert store.page(until='2000-01-01') == ([], None)